@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# append new rows to the binary data store of a dataset
+#
+# the csv has the same layout as data/{dataset}/train.csv (first column is the index, already
+# normalized, e.g. by data_process normalize_new_rows with the frozen statistics); the rows are
+# stored as a new segment and main.py extends its datasets with them on the next run
+
+import argparse
+import pandas as pd
+
+from util.net_struct import get_feature_map
+from util.store import append_data_store
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-dataset', help='dataset under ./data', type = str, required=True)
+    parser.add_argument('-csv', help='csv of the new rows', type = str, required=True)
+    parser.add_argument('-split', help='train / test', type = str, default='train')
+
+    args = parser.parse_args()
+
+    feature_map = get_feature_map(args.dataset)
+    df = pd.read_csv(args.csv, sep=',', index_col=0)
+
+    meta = append_data_store(args.dataset, feature_map, df, split=args.split)
+
+    split_meta = meta['splits'][args.split]
+    total_len = split_meta['shape'][1] + sum(segment['shape'][1] for segment in split_meta['segments'])
+    print(f'appended {len(df)} rows to {args.dataset} {args.split}, {total_len} rows in total')
@@ -0,0 +1,28 @@
+import torch
+from torch.utils.data import Sampler
+
+
+class ContiguousBatchSampler(Sampler):
+    # yields slice(start, end) batches over range(data_len), meant for DataLoader(batch_size=None)
+    # so the dataset cuts a whole batch at once; shuffle only reorders the batches,
+    # the samples inside a batch stay consecutive
+    def __init__(self, data_len, batch_size, shuffle=False, drop_last=False):
+        self.data_len = data_len
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        starts = torch.arange(0, len(self) * self.batch_size, self.batch_size)
+
+        if self.shuffle:
+            starts = starts[torch.randperm(len(starts))]
+
+        for start in starts.tolist():
+            yield slice(start, min(start + self.batch_size, self.data_len))
+
+    def __len__(self):
+        if self.drop_last:
+            return self.data_len // self.batch_size
+
+        return (self.data_len + self.batch_size - 1) // self.batch_size
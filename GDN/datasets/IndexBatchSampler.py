@@ -0,0 +1,18 @@
+import torch
+from torch.utils.data import Sampler, BatchSampler, RandomSampler, SequentialSampler
+
+
+class IndexBatchSampler(Sampler):
+    # yields one index tensor per batch, meant for DataLoader(batch_size=None) so the dataset
+    # gathers the whole batch with a single fancy index instead of batch_size __getitem__ calls;
+    # batches hold the same samples, in the same order, as DataLoader(batch_size=..., shuffle=...)
+    def __init__(self, data_len, batch_size, shuffle=False, drop_last=False):
+        sampler = RandomSampler(range(data_len)) if shuffle else SequentialSampler(range(data_len))
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+
+    def __iter__(self):
+        for batch in self.batch_sampler:
+            yield torch.tensor(batch)
+
+    def __len__(self):
+        return len(self.batch_sampler)
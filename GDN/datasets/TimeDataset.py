@@ -7,33 +7,38 @@ import numpy as np
 
 
 class TimeDataset(Dataset):
-    def __init__(self, raw_data, edge_index, mode='train', config = None):
+    def __init__(self, raw_data, mode='train', config = None):
         self.raw_data = raw_data
 
         self.config = config
-        self.edge_index = edge_index
         self.mode = mode
 
-        x_data = raw_data[:-1]
-        labels = raw_data[-1]
+        # raw_data: (x, labels), x is (node_num, time)
+        x_data, labels = raw_data
 
 
         data = x_data
 
-        # to tensor
-        data = torch.tensor(data).double()
-        labels = torch.tensor(labels).double()
+        # to tensor, float32 is what the model consumes so batches need no cast;
+        # float32 arrays such as the memory-mapped store are wrapped without a copy,
+        # so processes reading the same store share its pages
+        data = torch.from_numpy(np.asarray(data, dtype=np.float32))
+        labels = torch.from_numpy(np.asarray(labels, dtype=np.float32))
+
+        # (node_num, capacity) buffer, the first time_len timesteps are data
+        self.buffer = data
+        self.label_buffer = labels
+        self.time_len = data.shape[1]
 
         self.x, self.y, self.labels = self.process(data, labels)
-    
+
     def __len__(self):
         return len(self.x)
 
 
     def process(self, data, labels):
-        x_arr, y_arr = [], []
-        labels_arr = []
-
+        # windows are strided views over a single (node_num, time) buffer,
+        # nothing is copied per window
         slide_win, slide_stride = [self.config[k] for k
             in ['slide_win', 'slide_stride']
         ]
@@ -41,38 +46,50 @@ class TimeDataset(Dataset):
 
         node_num, total_time_len = data.shape
 
-        rang = range(slide_win, total_time_len, slide_stride) if is_train else range(slide_win, total_time_len)
-        
-        for i in rang:
-
-            ft = data[:, i-slide_win:i]
-            tar = data[:, i]
-
-            x_arr.append(ft)
-            y_arr.append(tar)
+        stride = slide_stride if is_train else 1
 
-            labels_arr.append(labels[i])
+        # sample k: window (node_num, slide_win) in front of target t = slide_win + k * stride,
+        # the value at t and its label
+        x = data.unfold(1, slide_win, 1).permute(1, 0, 2)[:total_time_len-slide_win:stride]
+        y = data.T[slide_win::stride]
+        labels = labels[slide_win::stride]
 
-
-        x = torch.stack(x_arr).contiguous()
-        y = torch.stack(y_arr).contiguous()
-
-        labels = torch.Tensor(labels_arr).contiguous()
-        
         return x, y, labels
 
-    def __getitem__(self, idx):
+    def extend(self, raw_data):
+        # append (x (node_num, time), labels) after the last timestep, the windows spanning the
+        # old end and the new data become samples; the buffer grows geometrically, so repeated
+        # appends cost amortized O(new timesteps) instead of copying all history every time
+        x_data, labels = raw_data
+        x_data = torch.from_numpy(np.asarray(x_data, dtype=np.float32))
+        labels = torch.from_numpy(np.asarray(labels, dtype=np.float32))
 
-        feature = self.x[idx].double()
-        y = self.y[idx].double()
+        new_time_len = self.time_len + x_data.shape[1]
+        capacity = self.buffer.shape[1]
 
-        edge_index = self.edge_index.long()
+        if new_time_len > capacity:
+            capacity = max(new_time_len, 2 * capacity)
 
-        label = self.labels[idx].double()
+            buffer = torch.empty((self.buffer.shape[0], capacity))
+            buffer[:, :self.time_len] = self.buffer[:, :self.time_len]
+            label_buffer = torch.empty(capacity)
+            label_buffer[:self.time_len] = self.label_buffer[:self.time_len]
 
-        return feature, y, label, edge_index
+            self.buffer, self.label_buffer = buffer, label_buffer
 
+        self.buffer[:, self.time_len:new_time_len] = x_data
+        self.label_buffer[self.time_len:new_time_len] = labels
+        self.time_len = new_time_len
 
+        self.x, self.y, self.labels = self.process(self.buffer[:, :self.time_len], self.label_buffer[:self.time_len])
 
+    def __getitem__(self, idx):
+        # idx may also be a slice (a batch that is a view of the buffer, no copy)
+        # or an index tensor (one gather for the whole batch)
+        feature = self.x[idx]
+        y = self.y[idx]
 
+        label = self.labels[idx]
 
+        # the graph is static and held by the model, samples don't carry it
+        return feature, y, label
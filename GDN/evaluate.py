@@ -1,41 +1,73 @@
 from util.data import *
+import os
+import json
 import numpy as np
 from sklearn.metrics import precision_score, recall_score, roc_auc_score, f1_score
 
 
-def get_full_err_scores(test_result, val_result):
-    np_test_result = np.array(test_result)
-    np_val_result = np.array(val_result)
+def get_full_err_scores(test_result, val_result=None, chunk_size=None):
+    # results as returned by test(): [predicted (sample, node), ground truth (sample, node), labels (sample,)]
+    # scores are (node, sample); chunk_size bounds how many sensors are scored at once
+    # without val_result only the test scores are computed and the normal scores are None
+    test_predict, test_gt = test_result[:2]
 
-    all_scores =  None
+    feature_num = test_predict.shape[-1]
+    if chunk_size is None:
+        chunk_size = feature_num
+
+    all_scores = np.empty((feature_num, len(test_predict)))
     all_normals = None
-    feature_num = np_test_result.shape[-1]
-
-    labels = np_test_result[2, :, 0].tolist()
-
-    for i in range(feature_num):
-        test_re_list = np_test_result[:2,:,i]
-        val_re_list = np_val_result[:2,:,i]
-
-        scores = get_err_scores(test_re_list, val_re_list)
-        normal_dist = get_err_scores(val_re_list, val_re_list)
-
-        if all_scores is None:
-            all_scores = scores
-            all_normals = normal_dist
-        else:
-            all_scores = np.vstack((
-                all_scores,
-                scores
-            ))
-            all_normals = np.vstack((
-                all_normals,
-                normal_dist
-            ))
+    if val_result is not None:
+        val_predict, val_gt = val_result[:2]
+        all_normals = np.empty((feature_num, len(val_predict)))
+
+    for start in range(0, feature_num, chunk_size):
+        end = min(start + chunk_size, feature_num)
+
+        test_re_list = (test_predict[:, start:end].T, test_gt[:, start:end].T)
+        all_scores[start:end] = get_err_scores(test_re_list, None)
+
+        if val_result is not None:
+            val_re_list = (val_predict[:, start:end].T, val_gt[:, start:end].T)
+            all_normals[start:end] = get_err_scores(val_re_list, val_re_list)
 
     return all_scores, all_normals
 
 
+def get_err_calibration(val_result):
+    # per-sensor error median / iqr of the validation results and the max normal top-k score
+    # for every topk (thresolds[k-1]), enough to score test data without the validation set
+    val_predict = np.asarray(val_result[0], dtype=np.float64).T
+    val_gt = np.asarray(val_result[1], dtype=np.float64).T
+
+    err_median, err_iqr = get_err_median_and_iqr(val_predict, val_gt, axis=-1)
+
+    normal_scores = get_err_scores((val_predict, val_gt), (val_predict, val_gt))
+    thresolds = np.max(get_topk_err_scores(normal_scores, list(range(1, len(normal_scores)+1))), axis=1)
+
+    return {
+        'err_median': err_median.tolist(),
+        'err_iqr': err_iqr.tolist(),
+        'thresolds': thresolds.tolist()
+    }
+
+def get_calibration_path(model_path):
+    # ./pretrained/msl/best_xxx.pt -> ./pretrained/msl/best_xxx.calibration.json
+    return f'{os.path.splitext(model_path)[0]}.calibration.json'
+
+def save_err_calibration(model_path, calibration):
+    with open(get_calibration_path(model_path), 'w') as f:
+        json.dump(calibration, f, indent=4)
+
+def load_err_calibration(model_path):
+    calibration_path = get_calibration_path(model_path)
+    if not os.path.exists(calibration_path):
+        return None
+
+    with open(calibration_path, 'r') as f:
+        return json.load(f)
+
+
 def get_final_err_scores(test_result, val_result):
     full_scores, all_normals = get_full_err_scores(test_result, val_result, return_normal_scores=True)
 
@@ -45,24 +77,29 @@ def get_final_err_scores(test_result, val_result):
 
 
 
-def get_err_scores(test_res, val_res):
+def get_err_scores(test_res, val_res=None):
+    # test_res: (predicted, ground truth) of shape (time,) or (node, time), scored along the last axis
+    # errors are normalized by the median / iqr of test_res itself, val_res is not used
     test_predict, test_gt = test_res
-    val_predict, val_gt = val_res
 
-    n_err_mid, n_err_iqr = get_err_median_and_iqr(test_predict, test_gt)
+    test_predict = np.asarray(test_predict, dtype=np.float64)
+    test_gt = np.asarray(test_gt, dtype=np.float64)
 
-    test_delta = np.abs(np.subtract(
-                        np.array(test_predict).astype(np.float64), 
-                        np.array(test_gt).astype(np.float64)
-                    ))
+    n_err_mid, n_err_iqr = get_err_median_and_iqr(test_predict, test_gt, axis=-1)
+
+    test_delta = np.abs(np.subtract(test_predict, test_gt))
     epsilon=1e-2
 
-    err_scores = (test_delta - n_err_mid) / ( np.abs(n_err_iqr) +epsilon)
+    err_scores = (test_delta - np.expand_dims(n_err_mid, -1)) / ( np.abs(np.expand_dims(n_err_iqr, -1)) +epsilon)
 
+    # moving average over the current and the before_num previous steps
     smoothed_err_scores = np.zeros(err_scores.shape)
     before_num = 3
-    for i in range(before_num, len(err_scores)):
-        smoothed_err_scores[i] = np.mean(err_scores[i-before_num:i+1])
+    time_len = err_scores.shape[-1]
+    if time_len > before_num:
+        for i in range(before_num + 1):
+            smoothed_err_scores[..., before_num:] += err_scores[..., i:time_len-before_num+i]
+        smoothed_err_scores /= before_num + 1
 
     
     return smoothed_err_scores
@@ -72,48 +109,40 @@ def get_err_scores(test_res, val_res):
 def get_loss(predict, gt):
     return eval_mseloss(predict, gt)
 
-def get_f1_scores(total_err_scores, gt_labels, topk=1):
-    print('total_err_scores', total_err_scores.shape)
-    # remove the highest and lowest score at each timestep
+def get_topk_err_scores(total_err_scores, topk=1):
+    # per-timestep sum of the topk largest sensor scores, (time,)
+    # topk may also be a list, then all sums come from one partition, (len(topk), time)
     total_features = total_err_scores.shape[0]
+    topks = np.atleast_1d(topk)
+    max_topk = int(topks.max())
 
-    # topk_indices = np.argpartition(total_err_scores, range(total_features-1-topk, total_features-1), axis=0)[-topk-1:-1]
-    topk_indices = np.argpartition(total_err_scores, range(total_features-topk-1, total_features), axis=0)[-topk:]
-    
-    topk_indices = np.transpose(topk_indices)
+    # the largest max_topk scores of each timestep, ascending
+    topk_indices = np.argpartition(total_err_scores, range(total_features-max_topk-1, total_features), axis=0)[-max_topk:]
+    topk_err_scores = np.take_along_axis(total_err_scores, topk_indices, axis=0)
 
-    total_topk_err_scores = []
-    topk_err_score_map=[]
-    # topk_anomaly_sensors = []
+    if np.ndim(topk) == 0:
+        return np.sum(topk_err_scores, axis=0)
 
-    for i, indexs in enumerate(topk_indices):
-       
-        sum_score = sum( score for k, score in enumerate(sorted([total_err_scores[index, i] for j, index in enumerate(indexs)])) )
+    # running sums from the largest score down, row k-1 is the top-k sum
+    topk_sums = np.cumsum(topk_err_scores[::-1], axis=0)
 
-        total_topk_err_scores.append(sum_score)
+    return topk_sums[topks - 1]
 
-    final_topk_fmeas = eval_scores(total_topk_err_scores, gt_labels, 400)
-
-    return final_topk_fmeas
-
-def get_val_performance_data(total_err_scores, normal_scores, gt_labels, topk=1):
-    total_features = total_err_scores.shape[0]
-
-    topk_indices = np.argpartition(total_err_scores, range(total_features-topk-1, total_features), axis=0)[-topk:]
+def get_f1_scores(total_err_scores, gt_labels, topk=1):
+    print('total_err_scores', total_err_scores.shape)
 
-    total_topk_err_scores = []
-    topk_err_score_map=[]
+    total_topk_err_scores = get_topk_err_scores(total_err_scores, topk)
 
-    total_topk_err_scores = np.sum(np.take_along_axis(total_err_scores, topk_indices, axis=0), axis=0)
+    if np.ndim(topk) > 0:
+        return [eval_scores(scores, gt_labels, 400) for scores in total_topk_err_scores]
 
-    thresold = np.max(normal_scores)
+    final_topk_fmeas = eval_scores(total_topk_err_scores, gt_labels, 400)
 
-    pred_labels = np.zeros(len(total_topk_err_scores))
-    pred_labels[total_topk_err_scores > thresold] = 1
+    return final_topk_fmeas
 
-    for i in range(len(pred_labels)):
-        pred_labels[i] = int(pred_labels[i])
-        gt_labels[i] = int(gt_labels[i])
+def get_val_performance(total_topk_err_scores, thresold, gt_labels):
+    gt_labels = np.asarray(gt_labels).astype(int)
+    pred_labels = (total_topk_err_scores > thresold).astype(int)
 
     pre = precision_score(gt_labels, pred_labels)
     rec = recall_score(gt_labels, pred_labels)
@@ -125,30 +154,28 @@ def get_val_performance_data(total_err_scores, normal_scores, gt_labels, topk=1)
 
     return f1, pre, rec, auc_score, thresold
 
+def get_val_performance_data(total_err_scores, normal_scores, gt_labels, topk=1, thresold=None):
+    # thresold defaults to the max normal score, pass a saved one to skip the validation scores
+    total_topk_err_scores = get_topk_err_scores(total_err_scores, topk)
 
-def get_best_performance_data(total_err_scores, gt_labels, topk=1):
+    if thresold is None:
+        thresold = np.max(normal_scores)
 
-    total_features = total_err_scores.shape[0]
+    if np.ndim(topk) > 0:
+        return [get_val_performance(scores, thresold, gt_labels) for scores in total_topk_err_scores]
 
-    # topk_indices = np.argpartition(total_err_scores, range(total_features-1-topk, total_features-1), axis=0)[-topk-1:-1]
-    topk_indices = np.argpartition(total_err_scores, range(total_features-topk-1, total_features), axis=0)[-topk:]
+    return get_val_performance(total_topk_err_scores, thresold, gt_labels)
 
-    total_topk_err_scores = []
-    topk_err_score_map=[]
 
-    total_topk_err_scores = np.sum(np.take_along_axis(total_err_scores, topk_indices, axis=0), axis=0)
+def get_best_performance(total_topk_err_scores, gt_labels):
+    gt_labels = np.asarray(gt_labels).astype(int)
 
     final_topk_fmeas ,thresolds = eval_scores(total_topk_err_scores, gt_labels, 400, return_thresold=True)
 
     th_i = final_topk_fmeas.index(max(final_topk_fmeas))
     thresold = thresolds[th_i]
 
-    pred_labels = np.zeros(len(total_topk_err_scores))
-    pred_labels[total_topk_err_scores > thresold] = 1
-
-    for i in range(len(pred_labels)):
-        pred_labels[i] = int(pred_labels[i])
-        gt_labels[i] = int(gt_labels[i])
+    pred_labels = (total_topk_err_scores > thresold).astype(int)
 
     pre = precision_score(gt_labels, pred_labels)
     rec = recall_score(gt_labels, pred_labels)
@@ -157,3 +184,11 @@ def get_best_performance_data(total_err_scores, gt_labels, topk=1):
 
     return max(final_topk_fmeas), pre, rec, auc_score, thresold
 
+def get_best_performance_data(total_err_scores, gt_labels, topk=1):
+    # topk=[1, ..., node_num] sweeps every topk over a single pass of the score matrix
+    total_topk_err_scores = get_topk_err_scores(total_err_scores, topk)
+
+    if np.ndim(topk) > 0:
+        return [get_best_performance(scores, gt_labels) for scores in total_topk_err_scores]
+
+    return get_best_performance(total_topk_err_scores, gt_labels)
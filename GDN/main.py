@@ -7,12 +7,15 @@ from torch.utils.data import DataLoader, random_split, Subset
 
 from sklearn.preprocessing import MinMaxScaler
 
-from util.env import get_device, set_device
-from util.preprocess import build_loc_net, construct_data
-from util.net_struct import get_feature_map, get_fc_graph_struc
+from util.env import get_device, set_device, set_precision, set_threads
+from util.preprocess import construct_data
+from util.net_struct import get_feature_map, get_graph_struc
 from util.iostream import printsep
+from util.store import load_data_store
 
 from datasets.TimeDataset import TimeDataset
+from datasets.ContiguousBatchSampler import ContiguousBatchSampler
+from datasets.IndexBatchSampler import IndexBatchSampler
 
 
 from models.GDN import GDN
@@ -20,6 +23,7 @@ from models.GDN import GDN
 from train import train
 from test  import test
 from evaluate import get_err_scores, get_best_performance_data, get_val_performance_data, get_full_err_scores
+from evaluate import get_err_calibration, save_err_calibration, load_err_calibration
 
 import sys
 from datetime import datetime
@@ -41,27 +45,27 @@ class Main():
         self.datestr = None
 
         dataset = self.env_config['dataset'] 
-        train_orig = pd.read_csv(f'./data/{dataset}/train.csv', sep=',', index_col=0)
-        test_orig = pd.read_csv(f'./data/{dataset}/test.csv', sep=',', index_col=0)
-       
-        train, test = train_orig, test_orig
-
-        if 'attack' in train.columns:
-            train = train.drop(columns=['attack'])
 
         feature_map = get_feature_map(dataset)
-        fc_struc = get_fc_graph_struc(dataset)
+
+        # memory-mapped binary copy of train.csv / test.csv, built on first use
+        store, store_meta = load_data_store(dataset, feature_map)
 
         set_device(env_config['device'])
+        set_precision(env_config['precision'])
+        set_threads(env_config['threads'], env_config['interop_threads'])
         self.device = get_device()
 
-        fc_edge_index = build_loc_net(fc_struc, list(train.columns), feature_map=feature_map)
-        fc_edge_index = torch.tensor(fc_edge_index, dtype = torch.long)
+        fc_edge_index = get_graph_struc(dataset, 'fc', store_meta['columns'], feature_map=feature_map)
+        fc_edge_index = torch.from_numpy(fc_edge_index)
 
         self.feature_map = feature_map
+        # node order of the data, feature_map without the features missing from the csv
+        self.features = [feature for feature in feature_map if feature in store_meta['columns']]
 
-        train_dataset_indata = construct_data(train, feature_map, labels=0)
-        test_dataset_indata = construct_data(test, feature_map, labels=test.attack.tolist())
+        # the csv rows and then any rows appended to the store since (util/store.py)
+        train_dataset_indata, *train_appended = store['train']
+        test_dataset_indata, *test_appended = store['test']
 
 
         cfg = {
@@ -69,8 +73,13 @@ class Main():
             'slide_stride': train_config['slide_stride'],
         }
 
-        train_dataset = TimeDataset(train_dataset_indata, fc_edge_index, mode='train', config=cfg)
-        test_dataset = TimeDataset(test_dataset_indata, fc_edge_index, mode='test', config=cfg)
+        train_dataset = TimeDataset(train_dataset_indata, mode='train', config=cfg)
+        test_dataset = TimeDataset(test_dataset_indata, mode='test', config=cfg)
+
+        for segment in train_appended:
+            train_dataset.extend(segment)
+        for segment in test_appended:
+            test_dataset.extend(segment)
 
 
         train_dataloader, val_dataloader = self.get_loaders(train_dataset, train_config['seed'], train_config['batch'], val_ratio = train_config['val_ratio'])
@@ -81,8 +90,7 @@ class Main():
 
         self.train_dataloader = train_dataloader
         self.val_dataloader = val_dataloader
-        self.test_dataloader = DataLoader(test_dataset, batch_size=train_config['batch'],
-                            shuffle=False, num_workers=0)
+        self.test_dataloader = self.get_dataloader(test_dataset, train_config['batch'], shuffle=False)
 
 
         edge_index_sets = []
@@ -93,12 +101,15 @@ class Main():
                 input_dim=train_config['slide_win'],
                 out_layer_num=train_config['out_layer_num'],
                 out_layer_inter_dim=train_config['out_layer_inter_dim'],
-                topk=train_config['topk']
+                topk=train_config['topk'],
+                graph_search=train_config['graph_search'],
+                search_block=train_config['search_block'],
+                graph_layer=train_config['graph_layer']
             ).to(self.device)
 
 
 
-    def run(self):
+    def run(self, epoch_callback=None):
 
         if len(self.env_config['load_model_path']) > 0:
             model_save_path = self.env_config['load_model_path']
@@ -106,14 +117,15 @@ class Main():
             model_save_path = self.get_save_path()[0]
 
             self.train_log = train(self.model, model_save_path, 
-                config = train_config,
+                config = self.train_config,
                 train_dataloader=self.train_dataloader,
                 val_dataloader=self.val_dataloader, 
                 feature_map=self.feature_map,
                 test_dataloader=self.test_dataloader,
                 test_dataset=self.test_dataset,
                 train_dataset=self.train_dataset,
-                dataset_name=self.env_config['dataset']
+                dataset_name=self.env_config['dataset'],
+                epoch_callback=epoch_callback
             )
         
         # test            
@@ -121,9 +133,21 @@ class Main():
         best_model = self.model.to(self.device)
 
         _, self.test_result = test(best_model, self.test_dataloader)
-        _, self.val_result = test(best_model, self.val_dataloader)
 
-        self.get_score(self.test_result, self.val_result)
+        # validation statistics are saved next to the model, a loaded model reuses them
+        self.val_result = None
+        self.calibration = None
+        if len(self.env_config['load_model_path']) > 0:
+            self.calibration = load_err_calibration(model_save_path)
+
+        if self.calibration is None or self.calibration['features'] != self.features:
+            _, self.val_result = test(best_model, self.val_dataloader)
+
+            self.calibration = get_err_calibration(self.val_result)
+            self.calibration['features'] = self.features
+            save_err_calibration(model_save_path, self.calibration)
+
+        return self.get_score(self.test_result, self.calibration)
 
     def get_loaders(self, train_dataset, seed, batch, val_ratio=0.1):
         dataset_len = int(len(train_dataset))
@@ -139,26 +163,43 @@ class Main():
         val_subset = Subset(train_dataset, val_sub_indices)
 
 
-        train_dataloader = DataLoader(train_subset, batch_size=batch,
-                                shuffle=True)
+        train_dataloader = self.get_dataloader(train_subset, batch, shuffle=True)
 
-        val_dataloader = DataLoader(val_subset, batch_size=batch,
-                                shuffle=False)
+        val_dataloader = self.get_dataloader(val_subset, batch, shuffle=False)
 
         return train_dataloader, val_dataloader
 
-    def get_score(self, test_result, val_result):
+    def get_dataloader(self, dataset, batch, shuffle=False):
+        num_workers = self.env_config['num_workers']
 
-        feature_num = len(test_result[0][0])
-        np_test_result = np.array(test_result)
-        np_val_result = np.array(val_result)
+        worker_config = {}
+        if num_workers > 0:
+            worker_config = {
+                'prefetch_factor': self.env_config['prefetch_factor'],
+                'persistent_workers': self.env_config['persistent_workers']
+            }
 
-        test_labels = np_test_result[2, :, 0].tolist()
+        # page-locked batches so host to gpu copies can overlap compute
+        pin_memory = torch.device(self.device).type == 'cuda'
+
+        # whole batches are indexed at once: one slice of the window buffer with -contiguous_batch,
+        # otherwise one gather of the sampled indices
+        if self.env_config['contiguous_batch']:
+            sampler = ContiguousBatchSampler(len(dataset), batch, shuffle=shuffle)
+        else:
+            sampler = IndexBatchSampler(len(dataset), batch, shuffle=shuffle)
+
+        return DataLoader(dataset, batch_size=None, sampler=sampler,
+                                num_workers=num_workers, pin_memory=pin_memory, **worker_config)
+
+    def get_score(self, test_result, calibration):
+
+        test_labels = test_result[2]
     
-        test_scores, normal_scores = get_full_err_scores(test_result, val_result)
+        test_scores, _ = get_full_err_scores(test_result)
 
         top1_best_info = get_best_performance_data(test_scores, test_labels, topk=1) 
-        top1_val_info = get_val_performance_data(test_scores, normal_scores, test_labels, topk=1)
+        top1_val_info = get_val_performance_data(test_scores, None, test_labels, topk=1, thresold=calibration['thresolds'][0])
 
 
         print('=========================** Result **============================\n')
@@ -173,6 +214,8 @@ class Main():
         print(f'precision: {info[1]}')
         print(f'recall: {info[2]}\n')
 
+        return info
+
 
     def get_save_path(self, feature_name=''):
 
@@ -194,8 +237,7 @@ class Main():
 
         return paths
 
-if __name__ == "__main__":
-
+def get_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-batch', help='batch size', type = int, default=128)
@@ -206,6 +248,9 @@ if __name__ == "__main__":
     parser.add_argument('-save_path_pattern', help='save path pattern', type = str, default='')
     parser.add_argument('-dataset', help='wadi / swat', type = str, default='wadi')
     parser.add_argument('-device', help='cuda / cpu', type = str, default='cuda')
+    parser.add_argument('-precision', help='fp32 / bf16 (autocast)', type = str, default='fp32')
+    parser.add_argument('-threads', help='intra-op threads, 0 for torch default', type = int, default=0)
+    parser.add_argument('-interop_threads', help='inter-op threads, 0 for torch default', type = int, default=0)
     parser.add_argument('-random_seed', help='random seed', type = int, default=0)
     parser.add_argument('-comment', help='experiment comment', type = str, default='')
     parser.add_argument('-out_layer_num', help='outlayer num', type = int, default=1)
@@ -213,21 +258,29 @@ if __name__ == "__main__":
     parser.add_argument('-decay', help='decay', type = float, default=0)
     parser.add_argument('-val_ratio', help='val ratio', type = float, default=0.1)
     parser.add_argument('-topk', help='topk num', type = int, default=20)
+    parser.add_argument('-graph_search', help='dense / blocked', type = str, default='dense')
+    parser.add_argument('-search_block', help='node block size of blocked graph search', type = int, default=1024)
+    parser.add_argument('-graph_layer', help='sparse / dense', type = str, default='sparse')
     parser.add_argument('-report', help='best / val', type = str, default='best')
     parser.add_argument('-load_model_path', help='trained model path', type = str, default='')
-
-    args = parser.parse_args()
-
-    random.seed(args.random_seed)
-    np.random.seed(args.random_seed)
-    torch.manual_seed(args.random_seed)
-    torch.cuda.manual_seed(args.random_seed)
-    torch.cuda.manual_seed_all(args.random_seed)
+    parser.add_argument('-num_workers', help='data loader worker processes, 0 loads in the main process', type = int, default=0)
+    parser.add_argument('-prefetch_factor', help='batches prefetched by every loader worker', type = int, default=2)
+    parser.add_argument('-persistent_workers', help='keep loader workers alive between epochs', action='store_true')
+    parser.add_argument('-contiguous_batch', help='batches of consecutive windows sliced at once, shuffled by batch', action='store_true')
+
+    return parser
+
+def set_random_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
     torch.backends.cudnn.benchmark = False
     torch.backends.cudnn.deterministic = True
-    os.environ['PYTHONHASHSEED'] = str(args.random_seed)
-
+    os.environ['PYTHONHASHSEED'] = str(seed)
 
+def get_configs(args):
     train_config = {
         'batch': args.batch,
         'epoch': args.epoch,
@@ -241,6 +294,9 @@ if __name__ == "__main__":
         'decay': args.decay,
         'val_ratio': args.val_ratio,
         'topk': args.topk,
+        'graph_search': args.graph_search,
+        'search_block': args.search_block,
+        'graph_layer': args.graph_layer,
     }
 
     env_config={
@@ -248,9 +304,25 @@ if __name__ == "__main__":
         'dataset': args.dataset,
         'report': args.report,
         'device': args.device,
-        'load_model_path': args.load_model_path
+        'precision': args.precision,
+        'threads': args.threads,
+        'interop_threads': args.interop_threads,
+        'load_model_path': args.load_model_path,
+        'num_workers': args.num_workers,
+        'prefetch_factor': args.prefetch_factor,
+        'persistent_workers': args.persistent_workers,
+        'contiguous_batch': args.contiguous_batch
     }
-    
+
+    return train_config, env_config
+
+if __name__ == "__main__":
+
+    args = get_parser().parse_args()
+
+    set_random_seed(args.random_seed)
+
+    train_config, env_config = get_configs(args)
 
     main = Main(train_config, env_config, debug=False)
     main.run()
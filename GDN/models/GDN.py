@@ -9,19 +9,51 @@ from torch_geometric.nn import GCNConv, GATConv, EdgeConv
 import math
 import torch.nn.functional as F
 
-from .graph_layer import GraphLayer
+from .graph_layer import GraphLayer, DenseGraphLayer
 
 
 def get_batch_edge_index(org_edge_index, batch_num, node_num):
     # org_edge_index:(2, edge_num)
-    edge_index = org_edge_index.clone().detach()
     edge_num = org_edge_index.shape[1]
-    batch_edge_index = edge_index.repeat(1,batch_num).contiguous()
 
-    for i in range(batch_num):
-        batch_edge_index[:, i*edge_num:(i+1)*edge_num] += i*node_num
+    # sample i of the batch is shifted by i*node_num
+    offsets = torch.arange(batch_num, device=org_edge_index.device).view(1, -1, 1) * node_num
+    batch_edge_index = org_edge_index.reshape(2, 1, edge_num) + offsets
 
-    return batch_edge_index.long()
+    return batch_edge_index.view(2, -1).long()
+
+
+def get_blocked_topk(weights, topk, block_size):
+    # cosine top-k of every row of weights, computed block by block with a running
+    # top-k merge so memory is bounded by block_size*(block_size+topk) instead of node_num^2
+    node_num = weights.shape[0]
+    device = weights.device
+    norms = weights.norm(dim=-1)
+
+    topk_indices = torch.empty(node_num, topk, dtype=torch.long, device=device)
+
+    for row_start in range(0, node_num, block_size):
+        rows = weights[row_start:row_start+block_size]
+        row_norms = norms[row_start:row_start+block_size]
+
+        best_vals, best_indices = None, None
+        for col_start in range(0, node_num, block_size):
+            cols = weights[col_start:col_start+block_size]
+            col_norms = norms[col_start:col_start+block_size]
+
+            vals = torch.matmul(rows, cols.T) / torch.matmul(row_norms.view(-1,1), col_norms.view(1,-1))
+            indices = torch.arange(col_start, col_start+cols.shape[0], device=device).expand_as(vals)
+
+            if best_vals is not None:
+                vals = torch.cat((best_vals, vals), dim=-1)
+                indices = torch.cat((best_indices, indices), dim=-1)
+
+            best_vals, pos = torch.topk(vals, min(topk, vals.shape[-1]), dim=-1)
+            best_indices = torch.gather(indices, -1, pos)
+
+        topk_indices[row_start:row_start+rows.shape[0]] = best_indices
+
+    return topk_indices
 
 
 class OutLayer(nn.Module):
@@ -58,11 +90,12 @@ class OutLayer(nn.Module):
 
 
 class GNNLayer(nn.Module):
-    def __init__(self, in_channel, out_channel, inter_dim=0, heads=1, node_num=100):
+    def __init__(self, in_channel, out_channel, inter_dim=0, heads=1, node_num=100, graph_layer='sparse'):
         super(GNNLayer, self).__init__()
 
-
-        self.gnn = GraphLayer(in_channel, out_channel, inter_dim=inter_dim, heads=heads, concat=False)
+        # dense: edge_index is a (node_num, k) neighbour table and x is (batch, node_num, in_channel)
+        layer_cls = DenseGraphLayer if graph_layer == 'dense' else GraphLayer
+        self.gnn = layer_cls(in_channel, out_channel, inter_dim=inter_dim, heads=heads, concat=False)
 
         self.bn = nn.BatchNorm1d(out_channel)
         self.relu = nn.ReLU()
@@ -80,7 +113,7 @@ class GNNLayer(nn.Module):
 
 
 class GDN(nn.Module):
-    def __init__(self, edge_index_sets, node_num, dim=64, out_layer_inter_dim=256, input_dim=10, out_layer_num=1, topk=20):
+    def __init__(self, edge_index_sets, node_num, dim=64, out_layer_inter_dim=256, input_dim=10, out_layer_num=1, topk=20, graph_search='dense', search_block=1024, graph_layer='sparse'):
 
         super(GDN, self).__init__()
 
@@ -98,18 +131,23 @@ class GDN(nn.Module):
 
         edge_set_num = len(edge_index_sets)
         self.gnn_layers = nn.ModuleList([
-            GNNLayer(input_dim, dim, inter_dim=dim+embed_dim, heads=1) for i in range(edge_set_num)
+            GNNLayer(input_dim, dim, inter_dim=dim+embed_dim, heads=1, graph_layer=graph_layer) for i in range(edge_set_num)
         ])
 
 
         self.node_embedding = None
         self.topk = topk
+        self.graph_search = graph_search
+        self.search_block = search_block
+        self.graph_layer = graph_layer
         self.learned_graph = None
+        self.gated_edge_index = None
+        self.learned_graph_version = None
 
         self.out_layer = OutLayer(dim*edge_set_num, node_num, out_layer_num, inter_num = out_layer_inter_dim)
 
-        self.cache_edge_index_sets = [None] * edge_set_num
-        self.cache_embed_index = None
+        self.cache_batch_gated_edge_index = None
+        self.cache_batch_gated_key = None
 
         self.dp = nn.Dropout(0.2)
 
@@ -118,8 +156,43 @@ class GDN(nn.Module):
     def init_params(self):
         nn.init.kaiming_uniform_(self.embedding.weight, a=math.sqrt(5))
 
+    def get_graph_version(self):
+        # the learned graph only depends on the embedding, which changes
+        # in place (optimizer step, load_state_dict) or by being replaced (.to())
+        weight = self.embedding.weight
+        return (weight.data_ptr(), weight._version)
+
+    def get_learned_graph(self, node_num):
+        # top-k cosine neighbours of every node, recomputed only when the embedding changed
+        version = (node_num, self.get_graph_version())
+        if self.learned_graph_version == version:
+            return self.learned_graph, self.gated_edge_index
 
-    def forward(self, data, org_edge_index):
+        weights = self.embedding.weight[:node_num].detach().clone()
+        device = weights.device
+
+        topk_num = self.topk
+
+        if self.graph_search == 'blocked':
+            topk_indices_ji = get_blocked_topk(weights, topk_num, self.search_block)
+        else:
+            cos_ji_mat = torch.matmul(weights, weights.T)
+            normed_mat = torch.matmul(weights.norm(dim=-1).view(-1,1), weights.norm(dim=-1).view(1,-1))
+            cos_ji_mat = cos_ji_mat / normed_mat
+
+            topk_indices_ji = torch.topk(cos_ji_mat, topk_num, dim=-1)[1]
+
+        gated_i = torch.arange(0, node_num).unsqueeze(1).repeat(1, topk_num).flatten().to(device).unsqueeze(0)
+        gated_j = topk_indices_ji.flatten().unsqueeze(0)
+        gated_edge_index = torch.cat((gated_j, gated_i), dim=0)
+
+        self.learned_graph = topk_indices_ji
+        self.gated_edge_index = gated_edge_index
+        self.learned_graph_version = version
+
+        return topk_indices_ji, gated_edge_index
+
+    def forward(self, data):
 
         x = data.clone().detach()
         edge_index_sets = self.edge_index_sets
@@ -127,43 +200,30 @@ class GDN(nn.Module):
         device = data.device
 
         batch_num, node_num, all_feature = x.shape
-        x = x.view(-1, all_feature).contiguous()
+        x = x.reshape(-1, all_feature)
 
 
         gcn_outs = []
         for i, edge_index in enumerate(edge_index_sets):
-            edge_num = edge_index.shape[1]
-            cache_edge_index = self.cache_edge_index_sets[i]
-
-            if cache_edge_index is None or cache_edge_index.shape[1] != edge_num*batch_num:
-                self.cache_edge_index_sets[i] = get_batch_edge_index(edge_index, batch_num, node_num).to(device)
-            
-            batch_edge_index = self.cache_edge_index_sets[i]
-            
             all_embeddings = self.embedding(torch.arange(node_num).to(device))
 
-            weights_arr = all_embeddings.detach().clone()
-            all_embeddings = all_embeddings.repeat(batch_num, 1)
-
-            weights = weights_arr.view(node_num, -1)
+            # in eval mode the embedding is frozen, so the learned graph and its
+            # batched edge index are built once per run instead of once per batch
+            topk_indices_ji, gated_edge_index = self.get_learned_graph(node_num)
 
-            cos_ji_mat = torch.matmul(weights, weights.T)
-            normed_mat = torch.matmul(weights.norm(dim=-1).view(-1,1), weights.norm(dim=-1).view(1,-1))
-            cos_ji_mat = cos_ji_mat / normed_mat
-
-            dim = weights.shape[-1]
-            topk_num = self.topk
-
-            topk_indices_ji = torch.topk(cos_ji_mat, topk_num, dim=-1)[1]
-
-            self.learned_graph = topk_indices_ji
+            if self.graph_layer == 'dense':
+                # every node has exactly topk in-neighbours, use the neighbour table directly
+                gcn_out = self.gnn_layers[i](x.view(batch_num, node_num, -1), topk_indices_ji, node_num=node_num*batch_num, embedding=all_embeddings)
+            else:
+                all_embeddings = all_embeddings.repeat(batch_num, 1)
 
-            gated_i = torch.arange(0, node_num).T.unsqueeze(1).repeat(1, topk_num).flatten().to(device).unsqueeze(0)
-            gated_j = topk_indices_ji.flatten().unsqueeze(0)
-            gated_edge_index = torch.cat((gated_j, gated_i), dim=0)
+                cache_key = (batch_num, self.learned_graph_version)
+                if self.cache_batch_gated_key != cache_key:
+                    self.cache_batch_gated_edge_index = get_batch_edge_index(gated_edge_index, batch_num, node_num).to(device)
+                    self.cache_batch_gated_key = cache_key
 
-            batch_gated_edge_index = get_batch_edge_index(gated_edge_index, batch_num, node_num).to(device)
-            gcn_out = self.gnn_layers[i](x, batch_gated_edge_index, node_num=node_num*batch_num, embedding=all_embeddings)
+                batch_gated_edge_index = self.cache_batch_gated_edge_index
+                gcn_out = self.gnn_layers[i](x, batch_gated_edge_index, node_num=node_num*batch_num, embedding=all_embeddings)
 
             
             gcn_outs.append(gcn_out)
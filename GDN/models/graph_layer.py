@@ -62,7 +62,20 @@ class GraphLayer(MessagePassing):
         edge_index, _ = add_self_loops(edge_index,
                                        num_nodes=x[1].size(self.node_dim))
 
-        out = self.propagate(edge_index, x=x, embedding=embedding, edges=edge_index,
+        # the attention logit is linear in (x, embedding), so it is scored once per
+        # node here and message() only gathers one scalar per edge and head
+        x_j = x[0].view(-1, self.heads, self.out_channels)
+        x_i = x[1].view(-1, self.heads, self.out_channels)
+
+        alpha_j = (x_j * self.att_j).sum(-1)
+        alpha_i = (x_i * self.att_i).sum(-1)
+
+        if embedding is not None:
+            embedding = embedding.unsqueeze(1)
+            alpha_j = alpha_j + (embedding * self.att_em_j).sum(-1)
+            alpha_i = alpha_i + (embedding * self.att_em_i).sum(-1)
+
+        out = self.propagate(edge_index, x=x, alpha=(alpha_j, alpha_i),
                              return_attention_weights=return_attention_weights)
 
         if self.concat:
@@ -79,44 +92,128 @@ class GraphLayer(MessagePassing):
         else:
             return out
 
-    def message(self, x_i, x_j, edge_index_i, size_i,
-                embedding,
-                edges,
+    def message(self, x_j, alpha_i, alpha_j, edge_index_i, size_i,
                 return_attention_weights):
 
-        x_i = x_i.view(-1, self.heads, self.out_channels)
         x_j = x_j.view(-1, self.heads, self.out_channels)
 
-        if embedding is not None:
-            embedding_i, embedding_j = embedding[edge_index_i], embedding[edges[0]]
-            embedding_i = embedding_i.unsqueeze(1).repeat(1,self.heads,1)
-            embedding_j = embedding_j.unsqueeze(1).repeat(1,self.heads,1)
+        alpha = alpha_i + alpha_j
 
-            key_i = torch.cat((x_i, embedding_i), dim=-1)
-            key_j = torch.cat((x_j, embedding_j), dim=-1)
+        alpha = alpha.view(-1, self.heads, 1)
 
 
+        alpha = F.leaky_relu(alpha, self.negative_slope)
+        alpha = softmax(alpha, edge_index_i, size_i)
+
+        if return_attention_weights:
+            self.__alpha__ = alpha
 
-        cat_att_i = torch.cat((self.att_i, self.att_em_i), dim=-1)
-        cat_att_j = torch.cat((self.att_j, self.att_em_j), dim=-1)
+        alpha = F.dropout(alpha, p=self.dropout, training=self.training)
+        
+        return x_j * alpha.view(-1, self.heads, 1)
 
-        alpha = (key_i * cat_att_i).sum(-1) + (key_j * cat_att_j).sum(-1)
 
 
-        alpha = alpha.view(-1, self.heads, 1)
+    def __repr__(self):
+        return '{}({}, {}, heads={})'.format(self.__class__.__name__,
+                                             self.in_channels,
+                                             self.out_channels, self.heads)
 
 
+class DenseGraphLayer(torch.nn.Module):
+    # GraphLayer for graphs where every node has the same number of in-neighbours
+    # (the learned top-k graph): attention is a dense softmax over a
+    # (node_num, topk+1) neighbour table instead of scatter based message passing.
+    # parameters and their names match GraphLayer, so state dicts are interchangeable
+    def __init__(self, in_channels, out_channels, heads=1, concat=True,
+                 negative_slope=0.2, dropout=0, bias=True, inter_dim=-1,**kwargs):
+        super(DenseGraphLayer, self).__init__()
+
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.heads = heads
+        self.concat = concat
+        self.negative_slope = negative_slope
+        self.dropout = dropout
+
+        self.__alpha__ = None
+
+        self.lin = Linear(in_channels, heads * out_channels, bias=False)
+
+        self.att_i = Parameter(torch.Tensor(1, heads, out_channels))
+        self.att_j = Parameter(torch.Tensor(1, heads, out_channels))
+        self.att_em_i = Parameter(torch.Tensor(1, heads, out_channels))
+        self.att_em_j = Parameter(torch.Tensor(1, heads, out_channels))
+
+        if bias and concat:
+            self.bias = Parameter(torch.Tensor(heads * out_channels))
+        elif bias and not concat:
+            self.bias = Parameter(torch.Tensor(out_channels))
+        else:
+            self.register_parameter('bias', None)
+
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        glorot(self.lin.weight)
+        glorot(self.att_i)
+        glorot(self.att_j)
+        
+        zeros(self.att_em_i)
+        zeros(self.att_em_j)
+
+        zeros(self.bias)
+
+    def forward(self, x, neighbors, embedding, return_attention_weights=False):
+        # x: (batch, node_num, in_channels), neighbors: (node_num, k), embedding: (node_num, out_channels)
+        batch_num, node_num, _ = x.shape
+        device = x.device
+
+        x = self.lin(x).view(batch_num, node_num, self.heads, self.out_channels)
+
+        alpha_j = (x * self.att_j).sum(-1)
+        alpha_i = (x * self.att_i).sum(-1)
+
+        if embedding is not None:
+            embedding = embedding.view(1, node_num, 1, -1)
+            alpha_j = alpha_j + (embedding * self.att_em_j).sum(-1)
+            alpha_i = alpha_i + (embedding * self.att_em_i).sum(-1)
+
+        # self loop as the last neighbour, self loops already in the top-k are
+        # masked out the same way remove_self_loops/add_self_loops drop them
+        self_index = torch.arange(node_num, device=device).view(-1, 1)
+        neighbors = torch.cat((neighbors, self_index), dim=-1)
+        self_mask = neighbors == self_index
+        self_mask[:, -1] = False
+
+        # (batch, node_num, k+1, heads)
+        alpha = alpha_i.unsqueeze(2) + alpha_j[:, neighbors]
+
         alpha = F.leaky_relu(alpha, self.negative_slope)
-        alpha = softmax(alpha, edge_index_i, size_i)
+        alpha = alpha.masked_fill(self_mask.view(1, node_num, -1, 1), float('-inf'))
+        alpha = torch.softmax(alpha, dim=2)
 
         if return_attention_weights:
             self.__alpha__ = alpha
 
         alpha = F.dropout(alpha, p=self.dropout, training=self.training)
-        
-        return x_j * alpha.view(-1, self.heads, 1)
 
+        # (batch, node_num, k+1, heads, out_channels) neighbour features
+        out = (x[:, neighbors] * alpha.unsqueeze(-1)).sum(2)
 
+        if self.concat:
+            out = out.reshape(-1, self.heads * self.out_channels)
+        else:
+            out = out.mean(dim=2).reshape(-1, self.out_channels)
+
+        if self.bias is not None:
+            out = out + self.bias
+
+        if return_attention_weights:
+            alpha, self.__alpha__ = self.__alpha__, None
+            return out, (neighbors, alpha)
+        else:
+            return out
 
     def __repr__(self):
         return '{}({}, {}, heads={})'.format(self.__class__.__name__,
@@ -0,0 +1,253 @@
+# two-pass chunked pipeline shared by process_swat.py and process_wadi.py
+#
+# pass 1: column means (nan fill) and train min / max (0-1 scaling), one chunk of rows at a time
+# pass 2: fill, scale, downsample and write every chunk straight into the binary data store
+#         (util/store.py) of the dataset, so neither the raw csv nor the result is held in memory
+#
+# downsampling aggregates each window per column (median / mean / min / max / last, see
+# get_downsample_config) over column blocks in a thread pool, numpy releases the gil there
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from util.store import create_split_arrays, write_direct_meta
+
+
+def read_chunks(path, prepare, chunksize):
+    # prepare(chunk) -> (features DataFrame, labels array)
+    for chunk in pd.read_csv(path, index_col=0, chunksize=chunksize):
+        yield prepare(chunk)
+
+def get_column_stats(path, prepare, chunksize):
+    sums = counts = mins = maxs = None
+    columns = None
+    row_num = 0
+
+    for features, _ in read_chunks(path, prepare, chunksize):
+        values = features.to_numpy(dtype=np.float64)
+
+        chunk_mins = np.fmin.reduce(values, axis=0)
+        chunk_maxs = np.fmax.reduce(values, axis=0)
+
+        if sums is None:
+            columns = list(features.columns)
+            sums, counts = np.nansum(values, axis=0), np.sum(~np.isnan(values), axis=0)
+            mins, maxs = chunk_mins, chunk_maxs
+        else:
+            sums += np.nansum(values, axis=0)
+            counts += np.sum(~np.isnan(values), axis=0)
+            mins, maxs = np.fmin(mins, chunk_mins), np.fmax(maxs, chunk_maxs)
+
+        row_num += len(values)
+
+    # like fillna(mean) then fillna(0): all-nan columns become 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nan_to_num(sums / counts, nan=0.0)
+    mins = np.nan_to_num(mins, nan=0.0)
+    maxs = np.nan_to_num(maxs, nan=0.0)
+
+    return {'columns': columns, 'mean': means, 'min': mins, 'max': maxs, 'rows': row_num}
+
+def get_scaler(stats):
+    # same transform as MinMaxScaler(feature_range=(0, 1)) fitted on the train split
+    data_range = stats['max'] - stats['min']
+    scale = 1.0 / np.where(data_range == 0, 1.0, data_range)
+    min_ = -stats['min'] * scale
+
+    return scale, min_
+
+# per-window aggregators, applied along axis 1 of (window, down_len, column) blocks
+aggregate_funcs = {
+    'median': np.median,
+    'mean': np.mean,
+    'min': np.min,
+    'max': np.max,
+    'last': lambda windows, axis: np.take(windows, -1, axis=axis)
+}
+
+def get_column_aggregators(columns, aggregators={}, default='median'):
+    # aggregators: column name -> aggregator name, other columns use default
+    names = [aggregators.get(col, default) for col in columns]
+
+    unknown = sorted(set(names) - set(aggregate_funcs))
+    if len(unknown) > 0:
+        raise ValueError(f'unknown aggregators {unknown}, expected one of {list(aggregate_funcs)}')
+
+    return names
+
+def aggregate_block(data, out, start, end, agg_names, down_len):
+    full_len = len(data) // down_len * down_len
+    block_names = agg_names[start:end]
+
+    for name in dict.fromkeys(block_names):
+        # whole block as a view when it shares one aggregator, else the columns of this one
+        if len(set(block_names)) == 1:
+            cols = slice(start, end)
+        else:
+            cols = [start+i for i, n in enumerate(block_names) if n == name]
+
+        func = aggregate_funcs[name]
+        block = data[:, cols]
+
+        out[:full_len//down_len, cols] = func(block[:full_len].reshape(-1, down_len, block.shape[1]), axis=1)
+        # a trailing partial window is aggregated over the rows it has
+        if full_len < len(data):
+            out[-1, cols] = func(block[full_len:][np.newaxis], axis=1)[0]
+
+# downsample by down_len, (time, column) data aggregated per column block in the thread pool,
+# max of the labels (if exist anomalies, then this sample is abnormal)
+def downsample(data, labels, down_len, agg_names, pool=None, column_block=8, keep_partial=True):
+    if not keep_partial:
+        data, labels = data[:len(data)//down_len*down_len], labels[:len(labels)//down_len*down_len]
+
+    down_time_len = -(-len(data) // down_len)
+    d_data = np.empty((down_time_len, data.shape[1]))
+
+    blocks = [(start, min(start+column_block, data.shape[1])) for start in range(0, data.shape[1], column_block)]
+    if pool is None:
+        for start, end in blocks:
+            aggregate_block(data, d_data, start, end, agg_names, down_len)
+    else:
+        jobs = [pool.submit(aggregate_block, data, d_data, start, end, agg_names, down_len) for start, end in blocks]
+        for job in jobs:
+            job.result()
+
+    full_len = len(labels) // down_len * down_len
+    d_labels = np.max(labels[:full_len].reshape(-1, down_len), axis=1)
+    if full_len < len(labels):
+        d_labels = np.append(d_labels, np.max(labels[full_len:]))
+    d_labels = np.round(d_labels)
+
+    return d_data, d_labels
+
+def write_split(path, prepare, chunksize, fill, scaler, down_config, skip, x, labels, pool):
+    scale, min_ = scaler
+    down_len = down_config['down_len']
+
+    carry_data = None
+    carry_labels = None
+    down_pos = 0
+    write_pos = 0
+
+    def write(values, chunk_labels):
+        nonlocal down_pos, write_pos
+
+        d_data, d_labels = downsample(values, chunk_labels, down_len, down_config['agg_names'], pool,
+            column_block=down_config['column_block'], keep_partial=down_config['keep_partial'])
+
+        # the first `skip` downsampled rows are not written
+        start = min(max(skip - down_pos, 0), len(d_data))
+        down_pos += len(d_data)
+        d_data, d_labels = d_data[start:], d_labels[start:]
+
+        x[:, write_pos:write_pos+len(d_data)] = d_data.T
+        labels[write_pos:write_pos+len(d_data)] = d_labels
+        write_pos += len(d_data)
+
+    for features, chunk_labels in read_chunks(path, prepare, chunksize):
+        values = features.to_numpy(dtype=np.float64)
+        values = np.where(np.isnan(values), fill, values)
+        values *= scale
+        values += min_
+
+        chunk_labels = np.asarray(chunk_labels, dtype=np.float64)
+
+        # rows left over from the previous chunk start the next downsample window
+        if carry_data is not None:
+            values = np.concatenate([carry_data, values])
+            chunk_labels = np.concatenate([carry_labels, chunk_labels])
+
+        full_len = len(values) // down_len * down_len
+        carry_data, carry_labels = values[full_len:], chunk_labels[full_len:]
+
+        if full_len > 0:
+            write(values[:full_len], chunk_labels[:full_len])
+
+    # rows of the last, partial window
+    if carry_data is not None and len(carry_data) > 0 and down_config['keep_partial']:
+        write(carry_data, carry_labels)
+
+    x.flush()
+    labels.flush()
+
+def add_downsample_args(parser):
+    parser.add_argument('-agg', help='downsample aggregator: median / mean / min / max / last', type = str, default='median')
+    parser.add_argument('-agg_config', help='json file of column name -> aggregator, other columns use -agg', type = str, default='')
+    parser.add_argument('-threads', help='threads aggregating column blocks', type = int, default=os.cpu_count())
+    parser.add_argument('-drop_partial', help='drop the trailing partial downsample window (as the original scripts)', action='store_true')
+
+def get_downsample_config(args, down_len=10):
+    aggregators = {}
+    if len(args.agg_config) > 0:
+        with open(args.agg_config, 'r') as f:
+            aggregators = json.load(f)
+
+    return {
+        'down_len': down_len,
+        'agg': args.agg,
+        'aggregators': aggregators,
+        'threads': args.threads,
+        'column_block': 8,
+        'keep_partial': not args.drop_partial
+    }
+
+def process(train_path, test_path, prepare_train, prepare_test, output_dir='.', down_config={}, train_skip=2160, chunksize=100000):
+    down_config = {
+        'down_len': 10,
+        'agg': 'median',
+        'aggregators': {},
+        'threads': 1,
+        'column_block': 8,
+        'keep_partial': True,
+        **down_config
+    }
+    down_len = down_config['down_len']
+
+    # chunksize is rounded to whole downsample windows
+    chunksize = max(chunksize // down_len, 1) * down_len
+
+    train_stats = get_column_stats(train_path, prepare_train, chunksize)
+    test_stats = get_column_stats(test_path, prepare_test, chunksize)
+
+    columns = train_stats['columns']
+    if len(test_stats['columns']) != len(columns):
+        raise ValueError(f'test has {len(test_stats["columns"])} columns, train has {len(columns)}')
+
+    down_config['agg_names'] = get_column_aggregators(columns, down_config['aggregators'], down_config['agg'])
+
+    scaler = get_scaler(train_stats)
+    store_dir = f'{output_dir}/cache'
+
+    shapes = {}
+    with ThreadPoolExecutor(max(down_config['threads'], 1)) as pool:
+        for split, path, prepare, stats, skip in [
+            ('train', train_path, prepare_train, train_stats, train_skip),
+            ('test', test_path, prepare_test, test_stats, 0)
+        ]:
+            if down_config['keep_partial']:
+                down_time_len = -(-stats['rows'] // down_len)
+            else:
+                down_time_len = stats['rows'] // down_len
+
+            time_len = max(down_time_len - skip, 0)
+            x, labels = create_split_arrays(store_dir, split, len(columns), time_len)
+
+            # each split fills its own nan with its own column means
+            write_split(path, prepare, chunksize, stats['mean'], scaler, down_config, skip, x, labels, pool)
+            shapes[split] = x.shape
+
+            del x, labels
+
+    write_direct_meta(store_dir, columns, shapes)
+
+    f = open(f'{output_dir}/list.txt', 'w')
+    for col in columns:
+        f.write(col+'\n')
+    f.close()
+
+    print(f'train {shapes["train"]}, test {shapes["test"]} written to {store_dir}')
@@ -1,101 +1,36 @@
+import argparse
 import numpy as np
 import pandas as pd
-import re
-from sklearn.preprocessing import MinMaxScaler
 
+from chunked_process import process, add_downsample_args, get_downsample_config
 
-# max min(0-1)
-def norm(train, test):
 
-    normalizer = MinMaxScaler(feature_range=(0, 1)).fit(train) # scale training data to [0,1] range
-    train_ret = normalizer.transform(train)
-    test_ret = normalizer.transform(test)
-
-    return train_ret, test_ret
-
-# downsample by 10
-def downsample(data, labels, down_len):
-    np_data = np.array(data)
-    np_labels = np.array(labels)
-
-    orig_len, col_num = np_data.shape
-
-    down_time_len = orig_len // down_len
-
-    np_data = np_data.transpose()
-
-    d_data = np_data[:, :down_time_len*down_len].reshape(col_num, -1, down_len)
-    d_data = np.median(d_data, axis=2).reshape(col_num, -1)
-
-    d_labels = np_labels[:down_time_len*down_len].reshape(-1, down_len)
-    # if exist anomalies, then this sample is abnormal
-    d_labels = np.round(np.max(d_labels, axis=1))
-
-
-    d_data = d_data.transpose()
-
-    return d_data.tolist(), d_labels.tolist()
-
-
-def main():
-
-    test = pd.read_csv('./swat_test.csv', index_col=0)
-    train = pd.read_csv('./swat_train.csv', index_col=0)
-
-
-    test = test.iloc[:, 1:]
-    train = train.iloc[:, 1:]
-
-    train = train.fillna(train.mean())
-    test = test.fillna(test.mean())
-    train = train.fillna(0)
-    test = test.fillna(0)
+def prepare(chunk):
+    chunk = chunk.iloc[:, 1:]
 
     # trim column names
-    train = train.rename(columns=lambda x: x.strip())
-    test = test.rename(columns=lambda x: x.strip())
-
-    # print(len(test.columns),test.columns)
-    # print(len(train.columns),train.columns)
-
-
-    train_labels = train.attack
-    test_labels = test.attack
-
-    train = train.drop(columns=['attack'])
-    test = test.drop(columns=['attack'])
-
-
-    x_train, x_test = norm(train.values, test.values)
+    chunk = chunk.rename(columns=lambda x: x.strip())
 
+    labels = chunk.attack.to_numpy()
+    features = chunk.drop(columns=['attack'])
 
-    for i, col in enumerate(train.columns):
-        train.loc[:, col] = x_train[:, i]
-        test.loc[:, col] = x_test[:, i]
+    return features, labels
 
 
-    d_train_x, d_train_labels = downsample(train.values, train_labels, 10)
-    d_test_x, d_test_labels = downsample(test.values, test_labels, 10)
-
-    train_df = pd.DataFrame(d_train_x, columns = train.columns)
-    test_df = pd.DataFrame(d_test_x, columns = test.columns)
-
-    test_df['attack'] = d_test_labels
-    train_df['attack'] = d_train_labels
-
-    train_df = train_df.iloc[2160:]
-
-    # print(train_df.values.shape)
-    # print(test_df.values.shape)
-
-
-    train_df.to_csv('./train.csv')
-    test_df.to_csv('./test.csv')
+def main():
 
-    f = open('./list.txt', 'w')
-    for col in train.columns:
-        f.write(col+'\n')
-    f.close()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-output_dir', help='where list.txt and the cache/ data store are written', type = str, default='.')
+    parser.add_argument('-chunksize', help='raw rows read at once', type = int, default=100000)
+    add_downsample_args(parser)
+    args = parser.parse_args()
+
+    process('./swat_train.csv', './swat_test.csv', prepare, prepare,
+        output_dir=args.output_dir,
+        down_config=get_downsample_config(args, down_len=10),
+        train_skip=2160,
+        chunksize=args.chunksize
+    )
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# online anomaly scoring with a trained GDN
+#
+# rows arrive as csv lines from stdin, a growing csv file or a local tcp socket; the first line is
+# the header (same columns as test.csv, first column is the index). every row is scored as soon as
+# the slide_win rows before it are known and written to stdout as
+#   tick,score,alarm,<smoothed score of every sensor>
+
+import sys
+import os
+import time
+import socket
+import selectors
+import argparse
+import numpy as np
+import torch
+
+from util.env import get_device, autocast
+from test import test
+from evaluate import get_err_calibration, get_topk_err_scores, save_err_calibration, load_err_calibration
+from main import Main, get_parser, get_configs, set_random_seed
+
+
+class StreamScorer():
+    def __init__(self, model, calibration, slide_win, topk=1, micro_batch=1, before_num=3, epsilon=1e-2):
+        # calibration: err_median / err_iqr per sensor and the alarm thresolds, see get_err_calibration
+        self.model = model
+        self.slide_win = slide_win
+        self.topk = topk
+        self.micro_batch = micro_batch
+        self.before_num = before_num
+        self.epsilon = epsilon
+
+        self.err_median = np.asarray(calibration['err_median'], dtype=np.float64)[:, None]
+        self.err_iqr = np.abs(np.asarray(calibration['err_iqr'], dtype=np.float64))[:, None]
+        self.thresold = calibration['thresolds'][topk-1]
+
+        node_num = len(self.err_median)
+
+        # last slide_win samples plus room for one micro batch, compacted when full
+        self.buffer = torch.zeros((node_num, slide_win + micro_batch))
+        self.buffer_len = 0
+
+        # normalized errors of the last before_num scored samples, for the moving average
+        self.err_history = np.zeros((node_num, 0))
+
+    def push(self, rows):
+        # rows: (m, node_num) new samples
+        # returns sensor scores (m', node_num), top-k scores (m',) and alarms (m',) of the m' rows
+        # that have a full window in front of them (all but the first slide_win rows of a stream)
+        rows = torch.as_tensor(np.asarray(rows, dtype=np.float32)).T
+
+        results = [self.score_batch(rows[:, i:i+self.micro_batch]) for i in range(0, rows.shape[1], self.micro_batch)]
+        sensor_scores, scores, alarms = [np.concatenate(res, axis=-1) for res in zip(*results)]
+
+        return sensor_scores.T, scores, alarms
+
+    def score_batch(self, rows):
+        device = get_device()
+        batch_len = rows.shape[1]
+
+        if self.buffer_len + batch_len > self.buffer.shape[1]:
+            keep = min(self.buffer_len, self.slide_win)
+            self.buffer[:, :keep] = self.buffer[:, self.buffer_len-keep:self.buffer_len].clone()
+            self.buffer_len = keep
+
+        start = self.buffer_len
+        self.buffer[:, start:start+batch_len] = rows
+        self.buffer_len += batch_len
+
+        first = max(start, self.slide_win)
+        if first >= self.buffer_len:
+            node_num = self.buffer.shape[0]
+            return np.zeros((node_num, 0)), np.zeros(0), np.zeros(0, dtype=bool)
+
+        # x[t]: window in front of target t, same layout as TimeDataset
+        x = self.buffer[:, first-self.slide_win:self.buffer_len-1].unfold(1, self.slide_win, 1).permute(1, 0, 2).contiguous()
+        y = self.buffer[:, first:self.buffer_len]
+
+        with torch.no_grad(), autocast():
+            predicted = self.model(x.to(device)).float()
+
+        predicted = predicted.cpu().numpy().T.astype(np.float64)
+        delta = np.abs(predicted - y.numpy().astype(np.float64))
+
+        err_scores = (delta - self.err_median) / (self.err_iqr + self.epsilon)
+
+        # same moving average as get_err_scores, the first before_num samples of a stream score 0
+        history = np.concatenate([self.err_history, err_scores], axis=1)
+        history_len = self.err_history.shape[1]
+        time_len = history.shape[1]
+
+        smoothed_err_scores = np.zeros(history.shape)
+        if time_len > self.before_num:
+            for i in range(self.before_num + 1):
+                smoothed_err_scores[:, self.before_num:] += history[:, i:time_len-self.before_num+i]
+            smoothed_err_scores /= self.before_num + 1
+
+        smoothed_err_scores = smoothed_err_scores[:, history_len:]
+        self.err_history = history[:, max(time_len-self.before_num, 0):]
+
+        scores = get_topk_err_scores(smoothed_err_scores, self.topk)
+
+        return smoothed_err_scores, scores, scores > self.thresold
+
+
+def read_fd_lines(fd, timeout):
+    # lines from a pipe / socket, None whenever nothing arrived within timeout seconds
+    sel = selectors.DefaultSelector()
+    sel.register(fd, selectors.EVENT_READ)
+
+    pending = b''
+    while True:
+        if not sel.select(timeout):
+            yield None
+            continue
+
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+
+        *lines, pending = (pending + chunk).split(b'\n')
+        for line in lines:
+            yield line.decode()
+
+    if pending:
+        yield pending.decode()
+
+def read_tail_lines(path, timeout, from_start=False):
+    # lines appended to a csv file, the header is always read from the top
+    while not os.path.exists(path):
+        yield None
+        time.sleep(timeout)
+
+    f = open(path, 'r')
+    header = ''
+    while not header.endswith('\n'):
+        header += f.readline()
+        if not header.endswith('\n'):
+            yield None
+            time.sleep(timeout)
+    yield header
+
+    if not from_start:
+        f.seek(0, os.SEEK_END)
+
+    pending = ''
+    while True:
+        pending += f.readline()
+        if pending.endswith('\n'):
+            yield pending
+            pending = ''
+        else:
+            yield None
+            time.sleep(timeout)
+
+def read_socket_lines(host, port, timeout):
+    # serves a single producer connection, the stream ends when it disconnects
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+
+    print(f'waiting for a producer on {host}:{port}', file=sys.stderr)
+    conn, _ = server.accept()
+    server.close()
+
+    with conn:
+        yield from read_fd_lines(conn.fileno(), timeout)
+
+def get_lines(args, timeout):
+    if args.source == 'stdin':
+        return read_fd_lines(sys.stdin.fileno(), timeout)
+    elif args.source == 'tail':
+        return read_tail_lines(args.path, timeout, from_start=args.from_start)
+    elif args.source == 'socket':
+        return read_socket_lines(args.host, args.port, timeout)
+
+    raise ValueError(f'unknown source {args.source}')
+
+
+def run_stream(scorer, lines, feature_map, micro_batch=1, max_delay=0.1, out=sys.stdout):
+    columns = None
+    ticks = []
+    rows = []
+    first_time = None
+
+    def flush():
+        sensor_scores, scores, alarms = scorer.push(np.stack(rows))
+
+        # rows without a full window yet are not reported
+        for tick, sensor_score, score, alarm in zip(ticks[len(ticks)-len(scores):], sensor_scores, scores, alarms):
+            out.write(','.join([tick, repr(float(score)), str(int(alarm))] + [f'{s:.6g}' for s in sensor_score]) + '\n')
+        out.flush()
+
+        ticks.clear()
+        rows.clear()
+
+    for line in lines:
+        if line is not None and len(line.strip()) > 0:
+            values = line.strip().split(',')
+
+            if columns is None:
+                # header: data columns in feature_map order, like construct_data
+                header = {name: i for i, name in enumerate(values)}
+                features = [feature for feature in feature_map if feature in header]
+                columns = [header[feature] for feature in features]
+
+                out.write(','.join(['tick', 'score', 'alarm'] + features) + '\n')
+                continue
+
+            ticks.append(values[0])
+            rows.append(np.array([float(values[i]) for i in columns], dtype=np.float32))
+
+            if first_time is None:
+                first_time = time.monotonic()
+
+        if len(rows) > 0 and (len(rows) >= micro_batch or time.monotonic() - first_time >= max_delay):
+            flush()
+            first_time = None
+
+    if len(rows) > 0:
+        flush()
+
+
+if __name__ == "__main__":
+
+    parser = get_parser()
+
+    parser.add_argument('-source', help='stdin / tail / socket', type = str, default='stdin')
+    parser.add_argument('-path', help='csv file followed by -source tail', type = str, default='')
+    parser.add_argument('-from_start', help='with -source tail, score the rows already in the file too', action='store_true')
+    parser.add_argument('-host', help='address -source socket listens on', type = str, default='127.0.0.1')
+    parser.add_argument('-port', help='port -source socket listens on', type = int, default=9999)
+    parser.add_argument('-micro_batch', help='rows scored per forward pass', type = int, default=1)
+    parser.add_argument('-max_delay', help='seconds a row may wait for its micro batch to fill', type = float, default=0.1)
+    parser.add_argument('-score_topk', help='sensors summed into the alarm score', type = int, default=1)
+
+    args = parser.parse_args()
+
+    if len(args.load_model_path) == 0:
+        parser.error('-load_model_path is required')
+
+    set_random_seed(args.random_seed)
+
+    train_config, env_config = get_configs(args)
+
+    # same model and validation split as main.py with these arguments
+    main = Main(train_config, env_config, debug=False)
+    model = main.model
+    model.load_state_dict(torch.load(args.load_model_path, map_location=get_device()))
+    model.eval()
+
+    # validation statistics saved by main.py next to the model, computed once if missing
+    calibration = load_err_calibration(args.load_model_path)
+    if calibration is None or calibration['features'] != main.features:
+        _, val_result = test(model, main.val_dataloader)
+
+        calibration = get_err_calibration(val_result)
+        calibration['features'] = main.features
+        save_err_calibration(args.load_model_path, calibration)
+
+    scorer = StreamScorer(model, calibration, train_config['slide_win'],
+        topk=args.score_topk,
+        micro_batch=args.micro_batch
+    )
+
+    poll = min(args.max_delay, 0.05)
+    run_stream(scorer, get_lines(args, poll), main.feature_map,
+        micro_batch=args.micro_batch,
+        max_delay=args.max_delay
+    )
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# hyperparameter sweep over main.py
+#
+# the spec is a json file mapping main.py arguments to the values to try, e.g.
+#   {"slide_win": [5, 10, 15], "topk": [5, 10], "dim": [32, 64]}
+# every other argument is taken from the command line as for main.py.
+# trials run in a process pool, each worker pinned to its own set of cores, and all of them
+# read the same memory-mapped data store. results go to ./results/{save_path}/sweep_{date}.csv
+
+import os
+import time
+import json
+import random
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from datetime import datetime
+from pathlib import Path
+
+from util.env import set_threads
+from util.net_struct import get_feature_map
+from util.store import load_data_store
+from main import Main, get_parser, get_configs, set_random_seed
+
+
+def get_trials(spec, search='grid', trial_num=0, seed=0):
+    keys = list(spec)
+    trials = [dict(zip(keys, values)) for values in itertools.product(*[spec[k] for k in keys])]
+
+    if search == 'random':
+        trials = random.Random(seed).sample(trials, min(trial_num, len(trials)))
+    elif search != 'grid':
+        raise ValueError(f'unknown search {search}')
+
+    return trials
+
+def get_core_sets(worker_num):
+    # disjoint blocks of the cores this process may run on, one per worker
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * worker_num
+
+    cores = sorted(os.sched_getaffinity(0))
+    worker_num = min(worker_num, len(cores))
+
+    return [block.tolist() for block in np.array_split(cores, worker_num)]
+
+def init_worker(core_sets):
+    cores = core_sets.get()
+
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+        set_threads(len(cores))
+
+def should_stop(progress, trial_id, epoch, loss, grace_epochs=3, min_trials=3):
+    # median stopping rule: drop a trial whose best loss so far is worse than the
+    # median best loss other trials had reached at the same epoch
+    best_loss = min(loss, progress.get((trial_id, epoch-1), loss))
+    progress[(trial_id, epoch)] = best_loss
+
+    if epoch < grace_epochs:
+        return False
+
+    others = [v for (other_id, other_epoch), v in progress.items() if other_epoch == epoch and other_id != trial_id]
+    if len(others) < min_trials:
+        return False
+
+    return best_loss > np.median(others)
+
+def run_trial(trial_id, params, base_args, progress, early_stop):
+    args = argparse.Namespace(**{**base_args, **params})
+    args.save_path_pattern = f'{args.save_path_pattern}/trial_{trial_id}'
+
+    set_random_seed(args.random_seed)
+    train_config, env_config = get_configs(args)
+
+    # the worker already set the thread count for its cores
+    env_config['threads'] = 0
+    env_config['interop_threads'] = 0
+
+    epochs = []
+    stopped = []
+    def epoch_callback(epoch, loss):
+        epochs.append(epoch)
+        if early_stop and should_stop(progress, trial_id, epoch, loss):
+            stopped.append(epoch)
+            return True
+        return False
+
+    start = time.time()
+
+    main = Main(train_config, env_config, debug=False)
+    f1, pre, rec, auc_score, _ = main.run(epoch_callback=epoch_callback)
+
+    return {
+        'trial': trial_id,
+        **params,
+        'f1': f1,
+        'precision': pre,
+        'recall': rec,
+        'auc': auc_score,
+        'epochs': len(epochs),
+        'early_stopped': len(stopped) > 0,
+        'wall_time': time.time() - start,
+        'model_path': main.get_save_path()[0]
+    }
+
+
+if __name__ == "__main__":
+
+    parser = get_parser()
+
+    parser.add_argument('-spec', help='json file of argument -> list of values', type = str, required=True)
+    parser.add_argument('-search', help='grid / random', type = str, default='grid')
+    parser.add_argument('-trials', help='number of sampled trials for -search random', type = int, default=10)
+    parser.add_argument('-workers', help='parallel trials, each pinned to its own cores', type = int, default=2)
+    parser.add_argument('-early_stop', help='stop trials worse than the median trial at the same epoch', action='store_true')
+
+    args = parser.parse_args()
+
+    with open(args.spec, 'r') as f:
+        spec = json.load(f)
+
+    base_args = vars(args)
+    unknown = [k for k in spec if k not in base_args]
+    if len(unknown) > 0:
+        parser.error(f'unknown arguments in spec: {", ".join(unknown)}')
+
+    trials = get_trials(spec, args.search, args.trials, args.random_seed)
+
+    datestr = datetime.now().strftime('%m-%d_%H-%M-%S')
+    save_path = args.save_path_pattern if len(args.save_path_pattern) > 0 else args.dataset
+    base_args['save_path_pattern'] = f'{save_path}/sweep_{datestr}'
+
+    # build the binary store once here, trials only map it
+    load_data_store(args.dataset, get_feature_map(args.dataset))
+
+    core_sets = get_core_sets(args.workers)
+    print(f'{len(trials)} trials on {len(core_sets)} workers')
+
+    ctx = mp.get_context('spawn')
+    with ctx.Manager() as manager:
+        core_queue = manager.Queue()
+        for cores in core_sets:
+            core_queue.put(cores)
+
+        progress = manager.dict()
+
+        with ctx.Pool(len(core_sets), initializer=init_worker, initargs=(core_queue,)) as pool:
+            jobs = [pool.apply_async(run_trial, (i, params, base_args, progress, args.early_stop)) for i, params in enumerate(trials)]
+            results = [job.get() for job in jobs]
+
+    result_path = f'./results/{save_path}/sweep_{datestr}.csv'
+    Path(os.path.dirname(result_path)).mkdir(parents=True, exist_ok=True)
+
+    results = pd.DataFrame(results).sort_values('f1', ascending=False)
+    results.to_csv(result_path, index=False)
+
+    print(results.to_string(index=False))
+    print(f'results saved to {result_path}')
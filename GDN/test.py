@@ -26,13 +26,12 @@ def test(model, dataloader):
     test_loss_list = []
     now = time.time()
 
-    test_predicted_list = []
-    test_ground_list = []
-    test_labels_list = []
-
-    t_test_predicted_list = []
-    t_test_ground_list = []
-    t_test_labels_list = []
+    # (sample, node) predictions / ground truth and one label per sample,
+    # written in place batch by batch
+    sample_num = len(dataloader.dataset)
+    test_predicted_list = None
+    test_ground_list = None
+    test_labels_list = np.zeros(sample_num, dtype=np.float32)
 
     test_len = len(dataloader)
 
@@ -40,26 +39,28 @@ def test(model, dataloader):
 
     i = 0
     acu_loss = 0
-    for x, y, labels, edge_index in dataloader:
-        x, y, labels, edge_index = [item.to(device).float() for item in [x, y, labels, edge_index]]
+    start = 0
+    for x, y, labels in dataloader:
+        x, y, labels = [item.to(device, non_blocking=True) for item in [x, y, labels]]
         
-        with torch.no_grad():
-            predicted = model(x, edge_index).float().to(device)
+        with torch.no_grad(), autocast():
+            predicted = model(x).float()
             
             
             loss = loss_func(predicted, y)
-            
 
-            labels = labels.unsqueeze(1).repeat(1, predicted.shape[1])
+        batch_num, node_num = predicted.shape
+        end = start + batch_num
+
+        if test_predicted_list is None:
+            test_predicted_list = np.zeros((sample_num, node_num), dtype=np.float32)
+            test_ground_list = np.zeros((sample_num, node_num), dtype=np.float32)
+
+        test_predicted_list[start:end] = predicted.cpu().numpy()
+        test_ground_list[start:end] = y.cpu().numpy()
+        test_labels_list[start:end] = labels.cpu().numpy()
 
-            if len(t_test_predicted_list) <= 0:
-                t_test_predicted_list = predicted
-                t_test_ground_list = y
-                t_test_labels_list = labels
-            else:
-                t_test_predicted_list = torch.cat((t_test_predicted_list, predicted), dim=0)
-                t_test_ground_list = torch.cat((t_test_ground_list, y), dim=0)
-                t_test_labels_list = torch.cat((t_test_labels_list, labels), dim=0)
+        start = end
         
         test_loss_list.append(loss.item())
         acu_loss += loss.item()
@@ -70,10 +71,6 @@ def test(model, dataloader):
             print(timeSincePlus(now, i / test_len))
 
 
-    test_predicted_list = t_test_predicted_list.tolist()        
-    test_ground_list = t_test_ground_list.tolist()        
-    test_labels_list = t_test_labels_list.tolist()      
-    
     avg_loss = sum(test_loss_list)/len(test_loss_list)
 
     return avg_loss, [test_predicted_list, test_ground_list, test_labels_list]
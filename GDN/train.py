@@ -24,7 +24,7 @@ def loss_func(y_pred, y_true):
 
 
 
-def train(model = None, save_path = '', config={},  train_dataloader=None, val_dataloader=None, feature_map={}, test_dataloader=None, test_dataset=None, dataset_name='swat', train_dataset=None):
+def train(model = None, save_path = '', config={},  train_dataloader=None, val_dataloader=None, feature_map={}, test_dataloader=None, test_dataset=None, dataset_name='swat', train_dataset=None, epoch_callback=None):
 
     seed = config['seed']
 
@@ -60,13 +60,15 @@ def train(model = None, save_path = '', config={},  train_dataloader=None, val_d
         acu_loss = 0
         model.train()
 
-        for x, labels, attack_labels, edge_index in dataloader:
+        for x, labels, attack_labels in dataloader:
             _start = time.time()
 
-            x, labels, edge_index = [item.float().to(device) for item in [x, labels, edge_index]]
+            x, labels = [item.to(device, non_blocking=True) for item in [x, labels]]
 
             optimizer.zero_grad()
-            out = model(x, edge_index).float().to(device)
+            with autocast():
+                out = model(x)
+            out = out.float()
             loss = loss_func(out, labels)
             
             loss.backward()
@@ -103,10 +105,14 @@ def train(model = None, save_path = '', config={},  train_dataloader=None, val_d
                 break
 
         else:
+            val_loss = acu_loss
             if acu_loss < min_loss :
                 torch.save(model.state_dict(), save_path)
                 min_loss = acu_loss
 
+        # epoch_callback(epoch, loss) returning True stops training, e.g. a sweep dropping a poor trial
+        if epoch_callback is not None and epoch_callback(i_epoch, val_loss):
+            break
 
 
     return train_loss_list
@@ -25,26 +25,53 @@ def get_attack_interval(attack):
     return res
 
 # calculate F1 scores
+# th_steps: number of evenly spaced rank quantiles, a sequence of quantiles in [0, 1),
+# or 'exact' to try every distinct score as threshold (predicting score > threshold)
 def eval_scores(scores, true_scores, th_steps, return_thresold=False):
-    padding_list = [0]*(len(true_scores) - len(scores))
-    # print(padding_list)
-
-    if len(padding_list) > 0:
-        scores = padding_list + scores
+    scores = np.asarray(scores, dtype=np.float64)
+    true_scores = np.asarray(true_scores)
 
-    scores_sorted = rankdata(scores, method='ordinal')
-    th_steps = th_steps
-    # th_steps = 500
-    th_vals = np.array(range(th_steps)) * 1.0 / th_steps
-    fmeas = [None] * th_steps
-    thresholds = [None] * th_steps
-    for i in range(th_steps):
-        cur_pred = scores_sorted > th_vals[i] * len(scores)
-
-        fmeas[i] = f1_score(true_scores, cur_pred)
+    padding_len = len(true_scores) - len(scores)
+    # print(padding_list)
 
-        score_index = scores_sorted.tolist().index(int(th_vals[i] * len(scores)+1))
-        thresholds[i] = scores[score_index]
+    if padding_len > 0:
+        scores = np.concatenate((np.zeros(padding_len), scores))
+
+    # sort once, sample at position k has ordinal rank k+1
+    score_len = len(scores)
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    sorted_true = true_scores[order] == 1
+
+    # true positives when every sample from position k on is predicted anomalous
+    tp_from = np.zeros(score_len + 1)
+    tp_from[:-1] = np.cumsum(sorted_true[::-1])[::-1]
+    true_num = tp_from[0]
+
+    if isinstance(th_steps, str) and th_steps == 'exact':
+        # last position of every distinct score
+        last = np.flatnonzero(np.append(sorted_scores[1:] != sorted_scores[:-1], True))
+        pred_from = last + 1
+        thresholds = sorted_scores[last]
+    else:
+        if np.ndim(th_steps) == 0:
+            th_vals = np.array(range(th_steps)) * 1.0 / th_steps
+        else:
+            th_vals = np.asarray(th_steps, dtype=np.float64)
+
+        # rank > th_val*len  <=>  position >= floor(th_val*len)
+        pred_from = np.clip(np.floor(th_vals * score_len).astype(int), 0, score_len)
+        th_ranks = np.clip((th_vals * score_len + 1).astype(int), 1, score_len)
+        thresholds = sorted_scores[th_ranks - 1]
+
+    tp = tp_from[pred_from]
+    pred_num = score_len - pred_from
+
+    denominator = pred_num + true_num
+    fmeas = np.divide(2 * tp, denominator, out=np.zeros(len(tp)), where=denominator > 0)
+
+    fmeas = fmeas.tolist()
+    thresholds = thresholds.tolist()
 
     if return_thresold:
         return fmeas, thresholds
@@ -72,12 +99,12 @@ def eval_mseloss(predicted, ground_truth):
 
     return loss
 
-def get_err_median_and_iqr(predicted, groundtruth):
+def get_err_median_and_iqr(predicted, groundtruth, axis=None):
 
     np_arr = np.abs(np.subtract(np.array(predicted), np.array(groundtruth)))
 
-    err_median = np.median(np_arr)
-    err_iqr = iqr(np_arr)
+    err_median = np.median(np_arr, axis=axis)
+    err_iqr = iqr(np_arr, axis=axis)
 
     return err_median, err_iqr
 
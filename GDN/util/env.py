@@ -2,6 +2,7 @@ import torch
 import numpy as np
 
 _device = None 
+_precision = 'fp32'
 
 def get_device():
     # return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -11,5 +12,24 @@ def set_device(dev):
     global _device
     _device = dev
 
+def get_precision():
+    return _precision
+
+def set_precision(precision):
+    global _precision
+    _precision = precision
+
+def autocast():
+    # bfloat16 autocast for the forward pass when precision is 'bf16', no-op for 'fp32'
+    device_type = torch.device(_device).type if _device is not None else 'cpu'
+    return torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=_precision == 'bf16')
+
+def set_threads(num_threads=0, num_interop_threads=0):
+    # 0 keeps torch's default
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0:
+        torch.set_num_interop_threads(num_interop_threads)
+
 def init_work(worker_id, seed):
     np.random.seed(seed + worker_id)
@@ -1,57 +1,103 @@
 import glob
+import numpy as np
 
 
 def get_feature_map(dataset):
-    feature_file = open(f'./data/{dataset}/list.txt', 'r')
-    feature_list = []
-    for ft in feature_file:
-        feature_list.append(ft.strip())
+    with open(f'./data/{dataset}/list.txt', 'r') as feature_file:
+        return [ft.strip() for ft in feature_file]
+
+def get_feature_index(feature_map):
+    # name -> position in feature_map, the first one for repeated names as list.index
+    feature_index = {}
+    for i, ft in enumerate(feature_map):
+        feature_index.setdefault(ft, i)
+
+    return feature_index
+
+def get_prior_groups(dataset, feature_list):
+    if dataset == 'wadi' or dataset == 'wadi2':
+        # same group, 1_xxx, 2A_xxx, 2_xxx
+        return [ft[0] for ft in feature_list]
+    elif dataset == 'swat':
+        # FIT101, PV101
+        return [ft[-3] for ft in feature_list]
+
+    # no prior, every node in its own group
+    return list(range(len(feature_list)))
+
+def get_edge_index(node_index, groups):
+    # edges [child, parent] between the different nodes of each group, ordered by parent and
+    # then child in node order; node_index maps the nodes to their feature_map positions
+    node_index = np.asarray(node_index, dtype=np.int64)
+    group_keys, group_ids = np.unique(np.asarray(groups), return_inverse=True)
+
+    parents, children = [], []
+    for group_id in range(len(group_keys)):
+        members = np.flatnonzero(group_ids == group_id)
+        size = len(members)
+
+        # row i: every member but member i
+        child_pos = np.arange(size-1)[np.newaxis, :]
+        child_pos = child_pos + (child_pos >= np.arange(size)[:, np.newaxis])
+
+        parents.append(np.repeat(members, size-1))
+        children.append(members[child_pos].ravel())
+
+    if len(parents) == 0:
+        return np.empty((2, 0), dtype=np.int64)
+
+    parents, children = np.concatenate(parents), np.concatenate(children)
+    if len(group_keys) > 1:
+        order = np.lexsort((children, parents))
+        parents, children = parents[order], children[order]
+
+    return np.stack([node_index[children], node_index[parents]])
+
+# kind 'fc' is 'fully-connect', 'prior' groups the nodes of features.txt by name (get_prior_groups)
+# returns the (2, edge_num) edge index over feature_map positions, nodes not in all_features are left out
+def get_graph_struc(dataset, kind='fc', all_features=None, feature_map=None):
+    if feature_map is None:
+        feature_map = get_feature_map(dataset)
+    feature_index = get_feature_index(feature_map)
+
+    if kind == 'fc':
+        nodes = feature_map
+    elif kind == 'prior':
+        with open(f'./data/{dataset}/features.txt', 'r') as feature_file:
+            nodes = [ft.strip() for ft in feature_file]
+    else:
+        raise ValueError(f'unknown graph {kind}, expected fc / prior')
+
+    nodes = list(dict.fromkeys(nodes))
+    if all_features is not None:
+        all_features = set(all_features)
+        nodes = [ft for ft in nodes if ft in all_features]
+
+    missing = [ft for ft in nodes if ft not in feature_index]
+    if len(missing) > 0:
+        print(f'error: {", ".join(missing)} not in feature_map')
+        nodes = [ft for ft in nodes if ft in feature_index]
+
+    groups = [0] * len(nodes) if kind == 'fc' else get_prior_groups(dataset, nodes)
+
+    return get_edge_index([feature_index[ft] for ft in nodes], groups)
 
-    return feature_list
 # graph is 'fully-connect'
 def get_fc_graph_struc(dataset):
-    feature_file = open(f'./data/{dataset}/list.txt', 'r')
+    feature_list = list(dict.fromkeys(get_feature_map(dataset)))
 
-    struc_map = {}
-    feature_list = []
-    for ft in feature_file:
-        feature_list.append(ft.strip())
+    return {ft: [other_ft for other_ft in feature_list if other_ft != ft] for ft in feature_list}
 
-    for ft in feature_list:
-        if ft not in struc_map:
-            struc_map[ft] = []
+def get_prior_graph_struc(dataset):
+    with open(f'./data/{dataset}/features.txt', 'r') as feature_file:
+        feature_list = list(dict.fromkeys(ft.strip() for ft in feature_file))
 
-        for other_ft in feature_list:
-            if other_ft is not ft:
-                struc_map[ft].append(other_ft)
-    
-    return struc_map
+    groups = get_prior_groups(dataset, feature_list)
 
-def get_prior_graph_struc(dataset):
-    feature_file = open(f'./data/{dataset}/features.txt', 'r')
-
-    struc_map = {}
-    feature_list = []
-    for ft in feature_file:
-        feature_list.append(ft.strip())
-
-    for ft in feature_list:
-        if ft not in struc_map:
-            struc_map[ft] = []
-        for other_ft in feature_list:
-            if dataset == 'wadi' or dataset == 'wadi2':
-                # same group, 1_xxx, 2A_xxx, 2_xxx
-                if other_ft is not ft and other_ft[0] == ft[0]:
-                    struc_map[ft].append(other_ft)
-            elif dataset == 'swat':
-                # FIT101, PV101
-                if other_ft is not ft and other_ft[-3] == ft[-3]:
-                    struc_map[ft].append(other_ft)
-
-    
-    return struc_map
+    return {ft: [other_ft for other_ft, other_group in zip(feature_list, groups) if other_ft != ft and other_group == group]
+        for ft, group in zip(feature_list, groups)}
 
 
 if __name__ == '__main__':
-    get_graph_struc()
- 
\ No newline at end of file
+    import sys
+    print(get_graph_struc(sys.argv[1]).shape)
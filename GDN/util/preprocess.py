@@ -65,26 +65,36 @@ def build_net(target, all_features):
 
 
 def construct_data(data, feature_map, labels=0):
-    res = []
+    columns = set(data.columns)
+    features = [feature for feature in feature_map if feature in columns]
+    missing = [feature for feature in feature_map if feature not in columns]
+
+    if len(missing) > 0:
+        print(', '.join(missing), 'not exist in data')
 
-    for feature in feature_map:
-        if feature in data.columns:
-            res.append(data.loc[:, feature].values.tolist())
-        else:
-            print(feature, 'not exist in data')
-    # append labels as last
-    sample_n = len(res[0])
+    # (node_num, time), rows in feature_map order
+    res = np.ascontiguousarray(data[features].to_numpy(dtype=np.float32).T)
+    sample_n = res.shape[1]
 
     if type(labels) == int:
-        res.append([labels]*sample_n)
-    elif len(labels) == sample_n:
-        res.append(labels)
+        labels = np.full(sample_n, labels, dtype=np.float32)
+    else:
+        labels = np.asarray(labels, dtype=np.float32)
 
-    return res
+    if len(labels) != sample_n:
+        raise ValueError(f'got {len(labels)} labels for {sample_n} samples')
+
+    return res, labels
 
 def build_loc_net(struc, all_features, feature_map=[]):
 
     index_feature_map = feature_map
+    # name -> index in index_feature_map, kept in step with the appends below
+    feature_index = {}
+    for i, ft in enumerate(index_feature_map):
+        feature_index.setdefault(ft, i)
+    all_features = set(all_features)
+
     edge_indexes = [
         [],
         []
@@ -93,19 +103,20 @@ def build_loc_net(struc, all_features, feature_map=[]):
         if node_name not in all_features:
             continue
 
-        if node_name not in index_feature_map:
+        if node_name not in feature_index:
+            feature_index[node_name] = len(index_feature_map)
             index_feature_map.append(node_name)
         
-        p_index = index_feature_map.index(node_name)
+        p_index = feature_index[node_name]
         for child in node_list:
             if child not in all_features:
                 continue
 
-            if child not in index_feature_map:
+            if child not in feature_index:
                 print(f'error: {child} not in index_feature_map')
                 # index_feature_map.append(child)
 
-            c_index = index_feature_map.index(child)
+            c_index = feature_index[child]
             # edge_indexes[0].append(p_index)
             # edge_indexes[1].append(c_index)
             edge_indexes[0].append(c_index)
@@ -113,4 +124,4 @@ def build_loc_net(struc, all_features, feature_map=[]):
         
 
     
-    return edge_indexes
\ No newline at end of file
+    return edge_indexes
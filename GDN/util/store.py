@@ -0,0 +1,179 @@
+# binary on-disk copy of ./data/{dataset}/{train,test}.csv
+#
+# data/{dataset}/cache
+#  |-meta.json          # feature order, data columns and the csv each split was built from
+#  |-train.npy          # float32 (node_num, time), rows in list.txt order
+#  |-train_labels.npy   # float32 (time,)
+#  |-test.npy
+#  |-test_labels.npy
+#  |-train_seg0.npy     # rows appended later by append_data_store, one pair of files per append
+#  |-train_seg0_labels.npy
+#
+# the chunked scripts/process_*.py pipelines write the splits directly, those have no csv source
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from util.preprocess import construct_data
+
+
+splits = ['train', 'test']
+
+
+def get_store_dir(dataset):
+    return f'./data/{dataset}/cache'
+
+def get_source_info(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def save_array(path, arr):
+    tmp_path = f'{path}.tmp.npy'
+    np.save(tmp_path, arr)
+    os.replace(tmp_path, path)
+
+def read_meta(dataset):
+    meta_path = f'{get_store_dir(dataset)}/meta.json'
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+def write_meta(store_dir, meta):
+    tmp_path = f'{store_dir}/meta.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, f'{store_dir}/meta.json')
+
+def is_store_valid(dataset, feature_map):
+    meta = read_meta(dataset)
+    if meta is None or meta['features'] != list(feature_map):
+        return False
+
+    for split in splits:
+        source = meta['splits'][split]['source']
+        if source is not None and source != get_source_info(f'./data/{dataset}/{split}.csv'):
+            return False
+
+    return True
+
+def build_data_store(dataset, feature_map):
+    store_dir = get_store_dir(dataset)
+    os.makedirs(store_dir, exist_ok=True)
+
+    old_meta = read_meta(dataset)
+    if old_meta is not None and any(len(v.get('segments', [])) > 0 for v in old_meta['splits'].values()):
+        print(f'{dataset} csv changed, rows appended to the old store are dropped')
+
+    meta = {
+        'features': list(feature_map),
+        'columns': None,
+        'splits': {}
+    }
+
+    for split in splits:
+        csv_path = f'./data/{dataset}/{split}.csv'
+        source = get_source_info(csv_path)
+        df = pd.read_csv(csv_path, sep=',', index_col=0)
+
+        labels = 0
+        if 'attack' in df.columns:
+            if split != 'train':
+                labels = df.attack.to_numpy()
+            df = df.drop(columns=['attack'])
+
+        if split == 'train':
+            meta['columns'] = list(df.columns)
+
+        x, y = construct_data(df, feature_map, labels=labels)
+
+        save_array(f'{store_dir}/{split}.npy', x)
+        save_array(f'{store_dir}/{split}_labels.npy', y)
+
+        meta['splits'][split] = {
+            'shape': list(x.shape),
+            'source': source,
+            'segments': []
+        }
+
+    write_meta(store_dir, meta)
+
+    return meta
+
+def create_split_arrays(store_dir, split, node_num, time_len):
+    # preallocated, memory-mapped (node_num, time_len) data and (time_len,) labels of a split
+    # for writers that fill it block by block instead of holding it in memory
+    os.makedirs(store_dir, exist_ok=True)
+
+    x = np.lib.format.open_memmap(f'{store_dir}/{split}.npy', mode='w+', dtype=np.float32, shape=(node_num, time_len))
+    labels = np.lib.format.open_memmap(f'{store_dir}/{split}_labels.npy', mode='w+', dtype=np.float32, shape=(time_len,))
+
+    return x, labels
+
+def write_direct_meta(store_dir, features, shapes):
+    # meta of splits written with create_split_arrays, valid as long as list.txt is unchanged
+    meta = {
+        'features': list(features),
+        'columns': list(features),
+        'splits': {
+            split: {'shape': list(shape), 'source': None, 'segments': []}
+            for split, shape in shapes.items()
+        }
+    }
+    write_meta(store_dir, meta)
+
+    return meta
+
+def append_data_store(dataset, feature_map, df, split='train'):
+    # append the rows of df (normalized like the csv, index column already set) to a split
+    # without touching the rows stored before; an 'attack' column is used as labels
+    meta = load_data_store(dataset, feature_map)[1]
+    store_dir = get_store_dir(dataset)
+
+    labels = 0
+    if 'attack' in df.columns:
+        labels = df.attack.to_numpy()
+        df = df.drop(columns=['attack'])
+
+    x, y = construct_data(df, feature_map, labels=labels)
+
+    node_num = meta['splits'][split]['shape'][0]
+    if x.shape[0] != node_num:
+        raise ValueError(f'appended rows have {x.shape[0]} features, the {split} split has {node_num}')
+
+    segments = meta['splits'][split].setdefault('segments', [])
+    name = f'{split}_seg{len(segments)}'
+
+    save_array(f'{store_dir}/{name}.npy', x)
+    save_array(f'{store_dir}/{name}_labels.npy', y)
+
+    segments.append({'name': name, 'shape': list(x.shape)})
+    write_meta(store_dir, meta)
+
+    return meta
+
+def load_data_store(dataset, feature_map):
+    # (re)build from csv once, afterwards every run only maps the binary files
+    # data[split] is a list of (x, labels): the csv rows followed by every appended segment
+    if not is_store_valid(dataset, feature_map):
+        print(f'building binary data store for {dataset}')
+        build_data_store(dataset, feature_map)
+
+    store_dir = get_store_dir(dataset)
+    meta = read_meta(dataset)
+
+    # copy-on-write maps: writable for torch.from_numpy, pages stay shared until written
+    data = {}
+    for split in splits:
+        names = [split] + [segment['name'] for segment in meta['splits'][split].get('segments', [])]
+
+        data[split] = []
+        for name in names:
+            x = np.load(f'{store_dir}/{name}.npy', mmap_mode='c')
+            labels = np.load(f'{store_dir}/{name}_labels.npy', mmap_mode='c')
+            data[split].append((x, labels))
+
+    return data, meta
@@ -3,11 +3,18 @@
 功能：对单个 CSV 文件执行以下处理
     1. 缺失值填充：对除时间戳之外的所有特征列，使用“列均值”填充缺失值
     2. Min–Max 归一化：将所有数值型特征缩放到 [0, 1]
-    3. 行号 104~116（含）为故障样本（label = 1），再从其前面同样数量的行中抽取正常样本（label = 0），两者合并为测试集
+    3. 故障区间内的行为故障样本（label = 1），再从每个区间前面同样数量的行中抽取正常样本（label = 0，不与任何故障区间重叠），
+       按时间顺序合并为测试集；故障区间来自 incident_path，未指定时为行号 104~116（含）
     4. 剩余行作为训练候选集，并对其进行 IQR 异常检测，剔除所有异常行，得到训练集
     5. 保存：
        - {output_prefix}_train.csv：训练集（时间戳 + 所有归一化特征，无标签，已剔除异常行）
        - {output_prefix}_test.csv ：测试集（时间戳 + 所有归一化特征 + 一列 label，包含故障与正常样本）
+       - {output_prefix}_stats.json：冻结的归一化统计量（列均值、最小值、最大值）和 IQR 上下界
+
+内存放不下的 CSV 用 preprocess_with_row_split_chunked 分块处理，输出与 preprocess_with_row_split 相同。
+
+新增数据（同样的 CSV 格式，如持续导出的 tabel1.csv）用 normalize_new_rows 按冻结的统计量归一化，
+不会重新计算整份历史数据；输出的 CSV 可用 GDN/append.py 追加到 GDN 的数据存储中。
 
 参数：
     input_csv_path (str)：待处理 CSV 文件路径
@@ -15,17 +22,152 @@
     timestamp_col    (str or None)：时间戳列的列名；若为 None，则自动使用 CSV 的第一列
     epsilon          (float)：筛选有效特征时 IQR 的下限阈值，默认 1e-6
     k                (float)：IQR 异常检测的放大系数，默认 1.5
+    incident_path    (str or None)：故障区间文件，CSV，每行一个区间 start,end（含两端），
+                     为行号（从 0 开始）或时间戳（与时间戳列比较，时间戳列需按时间升序）
 """
 
 import os
+import json
+import numpy as np
 import pandas as pd
 
+def normalize_features(features, stats):
+    """
+    用统计量（列均值、最小值、最大值）对整张表一次完成缺失值填充和 Min–Max 归一化，
+    所有值相等或全为 NaN 的列为 0
+    """
+    columns = list(features.columns)
+    min_vals = pd.Series(stats['min'], dtype=float)[columns]
+    max_vals = pd.Series(stats['max'], dtype=float)[columns]
+
+    # 如果存在缺失值，则用该列均值填充
+    features = features.fillna(pd.Series(stats['mean'], dtype=float)[columns])
+
+    scale = max_vals - min_vals
+    constant = scale.isna() | (scale == 0)
+
+    norm_feats = (features - min_vals) / scale.where(~constant, 1.0)
+    norm_feats.loc[:, constant] = 0.0
+
+    return norm_feats.astype(float)
+
+def get_iqr_bounds(Q1, Q3, epsilon=1e-6, k=1.5):
+    # 仅保留 IQR > epsilon 的“有效特征”，返回它们的正常上下界
+    IQR = Q3 - Q1
+
+    valid_cols = [col for col in Q1.index if IQR[col] > epsilon]
+    if not valid_cols:
+        valid_cols = list(Q1.index)
+
+    lower_bound = Q1[valid_cols] - k * IQR[valid_cols]
+    upper_bound = Q3[valid_cols] + k * IQR[valid_cols]
+
+    return lower_bound, upper_bound
+
+def get_normal_mask(feats, lower_bound, upper_bound):
+    # 所有有效特征都在上下界之间的行为正常行（整表广播比较）
+    bound_feats = feats[lower_bound.index]
+    return ~((bound_feats < lower_bound) | (bound_feats > upper_bound)).any(axis=1)
+
+def load_incidents(incident_path):
+    # 故障区间：start,end 两列（含两端），整数为行号，否则为时间戳
+    incidents = pd.read_csv(incident_path, encoding='utf-8')[['start', 'end']]
+
+    by_rows = all(pd.api.types.is_integer_dtype(incidents[col]) for col in ['start', 'end'])
+    if not by_rows:
+        incidents = incidents.apply(pd.to_datetime)
+
+    return incidents, by_rows
+
+def get_incident_row_bounds(incidents, timestamps):
+    # 时间戳区间换算成行号：start 之前的行数和 end 及之前的行数（timestamps 升序）
+    times = pd.to_datetime(timestamps).to_numpy()
+    start_rows = np.searchsorted(times, incidents['start'].to_numpy(), side='left')
+    end_rows = np.searchsorted(times, incidents['end'].to_numpy(), side='right')
+
+    return start_rows, end_rows
+
+def get_fault_intervals(start_rows, end_rows, total_rows):
+    """
+    行号区间 [start, end)：去掉空区间、截断到数据长度，按起点排序并合并重叠或相邻的区间，
+    返回闭区间的起点和终点数组
+    """
+    start_rows = np.clip(np.asarray(start_rows, dtype=np.int64), 0, total_rows)
+    end_rows = np.clip(np.asarray(end_rows, dtype=np.int64), 0, total_rows)
+
+    keep = end_rows > start_rows
+    if not keep.any():
+        raise ValueError("故障区间与数据没有交集，请检查故障区间文件。")
+
+    order = np.argsort(start_rows[keep], kind='stable')
+    starts = start_rows[keep][order]
+    ends = end_rows[keep][order] - 1
+
+    # 起点超过此前所有区间的终点 + 1 时开始一个新区间
+    running_ends = np.maximum.accumulate(ends)
+    is_new = np.concatenate([[True], starts[1:] > running_ends[:-1] + 1])
+    group_heads = np.flatnonzero(is_new)
+
+    return starts[group_heads], np.maximum.reduceat(ends, group_heads)
+
+def get_normal_intervals(fault_starts, fault_ends):
+    # 每个故障区间前面同样数量的行，不越过上一个故障区间；不够时取能取到的部分
+    lengths = fault_ends - fault_starts + 1
+    prev_ends = np.concatenate([[-1], fault_ends[:-1]])
+
+    normal_starts = np.maximum(fault_starts - lengths, prev_ends + 1)
+    normal_ends = fault_starts - 1
+
+    short = (normal_ends - normal_starts + 1) < lengths
+    if short.any():
+        print(f"{short.sum()} 个故障区间前面的正常样本不足区间长度，只取到可用的行。")
+
+    keep = normal_ends >= normal_starts
+    return normal_starts[keep], normal_ends[keep]
+
+def in_intervals(positions, starts, ends):
+    # 区间有序且不重叠：searchsorted 找到每行之前最近的区间起点，再比较终点，O(T log K)
+    if len(starts) == 0:
+        return np.zeros(len(positions), dtype=bool)
+
+    idx = np.searchsorted(starts, positions, side='right') - 1
+    return (idx >= 0) & (positions <= ends[np.maximum(idx, 0)])
+
+def get_test_intervals(incident_path, total_rows, timestamps=None):
+    # 故障区间和对应的正常样本区间；未指定故障区间文件时为行号 104~116（含）
+    if incident_path is None:
+        start_rows, end_rows = np.array([104]), np.array([117])
+    else:
+        incidents, by_rows = load_incidents(incident_path)
+        if by_rows:
+            start_rows, end_rows = incidents['start'].to_numpy(), incidents['end'].to_numpy() + 1
+        else:
+            start_rows, end_rows = get_incident_row_bounds(incidents, timestamps)
+
+    fault_intervals = get_fault_intervals(start_rows, end_rows, total_rows)
+    normal_intervals = get_normal_intervals(*fault_intervals)
+
+    return fault_intervals, normal_intervals
+
+def save_outputs(output_prefix, stats):
+    # 确保输出目录存在，返回训练集、测试集和统计量的路径
+    output_dir = os.path.dirname(output_prefix)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    stats_output_path = f"{output_prefix}_stats.json"
+    save_stats(stats, stats_output_path)
+    print(f"归一化统计量已保存到：{stats_output_path}")
+
+    return f"{output_prefix}_train.csv", f"{output_prefix}_test.csv"
+
 def preprocess_with_row_split(
     input_csv_path: str,
     output_prefix: str,
     timestamp_col: str = None,
     epsilon: float = 1e-6,
-    k: float = 1.5
+    k: float = 1.5,
+    incident_path: str = None
 ):
     # 1. 读取 CSV 并自动识别表头
     df = pd.read_csv(input_csv_path, encoding='utf-8')
@@ -38,23 +180,15 @@ def preprocess_with_row_split(
     timestamps = df[timestamp_col]
     features   = df.drop(columns=[timestamp_col])
 
-    # 4. 对每个特征列先填充缺失值（用列均值），再做 Min–Max 归一化
-    norm_feats = pd.DataFrame(index=features.index)
-    for col in features.columns:
-        col_series = features[col]
-        # 如果存在缺失值，则用该列均值填充
-        if col_series.isnull().any():
-            mean_val = col_series.mean()
-            col_series = col_series.fillna(mean_val)
-        # 计算最小值和最大值
-        min_val = col_series.min()
-        max_val = col_series.max()
-        # 如果该列所有值相等或全为 NaN，就用 0；否则做 (x - min) / (max - min)
-        if pd.isna(min_val) or pd.isna(max_val) or max_val == min_val:
-            normalized = col_series.apply(lambda x: 0.0)
-        else:
-            normalized = (col_series - min_val) / (max_val - min_val)
-        norm_feats[col] = normalized
+    # 4. 整表计算列均值、最小值和最大值（冻结下来供之后新增的数据使用），再做填充和 Min–Max 归一化
+    stats = {
+        'timestamp_col': timestamp_col,
+        'columns': list(features.columns),
+        'mean': features.mean().to_dict(),
+        'min': features.min().to_dict(),
+        'max': features.max().to_dict()
+    }
+    norm_feats = normalize_features(features, stats)
 
     # 5. 将归一化后的特征与时间戳合并，形成完整的 DataFrame
     processed_df = pd.concat(
@@ -62,65 +196,33 @@ def preprocess_with_row_split(
         axis=1
     )
 
-    # 6. 指定行号 104~116（含）为故障数据，构成测试集中 label=1 的部分
-    fault_indices = list(range(104, 117))  # loc 索引从 0 开始，对应第 105~117 行
-    num_faults = len(fault_indices)
+    # 6~7. 故障区间内的行（label=1）和每个区间前面同样数量的正常行（label=0），所有区间一次完成
+    fault_intervals, normal_intervals = get_test_intervals(incident_path, len(processed_df), timestamps)
 
-    # 7. 从故障区间前面同样数量的行中抽取“正常”测试样本，作为 label=0
-    #    保证这段范围不会与故障区间重叠
-    normal_indices = list(range(fault_indices[0] - num_faults, fault_indices[0]))
-    # 在实际数据长度不够时，需提前检查
-    if normal_indices[0] < 0:
-        raise ValueError("normal_indices 超出范围，请调整取样逻辑或检查行数是否足够。")
+    positions = np.arange(len(processed_df))
+    fault_mask = in_intervals(positions, *fault_intervals)
+    test_mask = fault_mask | in_intervals(positions, *normal_intervals)
 
-    # 8. 构造测试集，将故障与正常样本合并
-    test_fault_df = processed_df.loc[fault_indices].reset_index(drop=True).copy()
-    test_fault_df['label'] = 1
-
-    test_normal_df = processed_df.loc[normal_indices].reset_index(drop=True).copy()
-    test_normal_df['label'] = 0
-
-    test_df = pd.concat([test_normal_df, test_fault_df], axis=0).reset_index(drop=True)
+    # 8. 构造测试集，故障与正常样本按时间顺序排列
+    test_df = processed_df[test_mask].reset_index(drop=True).copy()
+    test_df['label'] = fault_mask[test_mask].astype(int)
 
     # 9. 剩余行作为训练候选集
-    train_candidates = processed_df.drop(index=fault_indices + normal_indices).reset_index(drop=True)
+    train_candidates = processed_df[~test_mask].reset_index(drop=True)
 
     # 10. 在训练候选集上进行 IQR 异常检测，并剔除所有异常行
     feat_cols = [col for col in train_candidates.columns if col != timestamp_col]
     train_feats = train_candidates[feat_cols]
 
-    # 10.1 计算 Q1, Q3, IQR
-    Q1 = train_feats.quantile(0.25)
-    Q3 = train_feats.quantile(0.75)
-    IQR = Q3 - Q1
-
-    # 10.2 筛选“有效特征”：仅保留 IQR > epsilon 的列
-    valid_cols = [col for col in feat_cols if IQR[col] > epsilon]
-    if not valid_cols:
-        valid_cols = feat_cols.copy()
-
-    # 10.3 计算有效特征的正常上下界
-    lower_bound = Q1[valid_cols] - k * IQR[valid_cols]
-    upper_bound = Q3[valid_cols] + k * IQR[valid_cols]
-
-    # 10.4 判断训练候选集中哪些行是正常的：所有有效特征都在上下界之间
-    def is_normal_row(row):
-        too_low  = row < lower_bound
-        too_high = row > upper_bound
-        return not (too_low.any() or too_high.any())
+    lower_bound, upper_bound = get_iqr_bounds(train_feats.quantile(0.25), train_feats.quantile(0.75), epsilon, k)
 
-    train_valid_feats = train_feats[valid_cols]
-    mask_train_normal = train_valid_feats.apply(is_normal_row, axis=1)
+    mask_train_normal = get_normal_mask(train_feats, lower_bound, upper_bound)
     train_df = train_candidates[mask_train_normal].reset_index(drop=True)
 
-    # 11. 确保输出目录存在
-    output_dir = os.path.dirname(output_prefix)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # 12. 保存训练集和测试集
-    train_output_path = f"{output_prefix}_train.csv"
-    test_output_path  = f"{output_prefix}_test.csv"
+    # 11~12. 保存训练集、测试集和统计量
+    stats['lower_bound'] = lower_bound.to_dict()
+    stats['upper_bound'] = upper_bound.to_dict()
+    train_output_path, test_output_path = save_outputs(output_prefix, stats)
 
     # 训练集不含 label，仅包含时间戳和归一化特征
     train_df.to_csv(train_output_path, index=False, encoding='utf-8')
@@ -132,6 +234,169 @@ def preprocess_with_row_split(
 
     return train_df, test_df
 
+def preprocess_with_row_split_chunked(
+    input_csv_path: str,
+    output_prefix: str,
+    timestamp_col: str = None,
+    epsilon: float = 1e-6,
+    k: float = 1.5,
+    chunksize: int = 100000,
+    column_block: int = 8,
+    incident_path: str = None
+):
+    """
+    与 preprocess_with_row_split 相同的处理，但不把整个 CSV 读入内存：
+        第 1 遍：分块只读时间戳列，统计总行数，时间戳故障区间换算成行号
+        第 2 遍：每次只读 column_block 列（usecols），计算列均值、最小值、最大值，
+                在训练候选行上计算精确的分位数和 IQR 上下界
+        第 3 遍：分块归一化、筛选，训练集边处理边写入
+    内存占用约为 chunksize 行或 column_block 列；返回训练集行数和测试集
+    """
+    columns = list(pd.read_csv(input_csv_path, encoding='utf-8', nrows=0).columns)
+    if timestamp_col is None:
+        timestamp_col = columns[0]
+    feat_cols = [col for col in columns if col != timestamp_col]
+
+    incidents, by_rows = load_incidents(incident_path) if incident_path is not None else (None, True)
+
+    # 第 1 遍：总行数，时间戳故障区间换算成行号
+    total_rows = 0
+    start_rows = end_rows = 0
+    for chunk in pd.read_csv(input_csv_path, encoding='utf-8', usecols=[timestamp_col], chunksize=chunksize):
+        if not by_rows:
+            chunk_start_rows, chunk_end_rows = get_incident_row_bounds(incidents, chunk[timestamp_col])
+            start_rows, end_rows = start_rows + chunk_start_rows, end_rows + chunk_end_rows
+        total_rows += len(chunk)
+
+    if by_rows:
+        fault_intervals, normal_intervals = get_test_intervals(incident_path, total_rows)
+    else:
+        fault_intervals = get_fault_intervals(start_rows, end_rows, total_rows)
+        normal_intervals = get_normal_intervals(*fault_intervals)
+
+    def get_chunk_masks(chunk_start, chunk_len):
+        positions = np.arange(chunk_start, chunk_start + chunk_len)
+        fault_mask = in_intervals(positions, *fault_intervals)
+        return fault_mask, fault_mask | in_intervals(positions, *normal_intervals)
+
+    # 第 2 遍：按列块读取整列，计算统计量和训练候选行上的分位数
+    train_candidate_mask = ~get_chunk_masks(0, total_rows)[1]
+
+    stats = {'timestamp_col': timestamp_col, 'columns': feat_cols, 'mean': {}, 'min': {}, 'max': {}}
+    Q1, Q3 = [], []
+    for start in range(0, len(feat_cols), column_block):
+        block_cols = feat_cols[start:start + column_block]
+        block = pd.read_csv(input_csv_path, encoding='utf-8', usecols=block_cols)[block_cols]
+
+        stats['mean'].update(block.mean().to_dict())
+        stats['min'].update(block.min().to_dict())
+        stats['max'].update(block.max().to_dict())
+
+        block = normalize_features(block[train_candidate_mask], stats)
+
+        Q1.append(block.quantile(0.25))
+        Q3.append(block.quantile(0.75))
+        del block
+
+    lower_bound, upper_bound = get_iqr_bounds(pd.concat(Q1), pd.concat(Q3), epsilon, k)
+
+    stats['lower_bound'] = lower_bound.to_dict()
+    stats['upper_bound'] = upper_bound.to_dict()
+    train_output_path, test_output_path = save_outputs(output_prefix, stats)
+
+    # 第 3 遍：归一化、筛选并写入训练集，收集测试样本
+    test_rows = []
+    train_rows = 0
+    chunk_start = 0
+    for chunk in pd.read_csv(input_csv_path, encoding='utf-8', chunksize=chunksize):
+        chunk = chunk.reset_index(drop=True)
+        chunk.index += chunk_start
+        chunk_start += len(chunk)
+
+        processed = pd.concat([chunk[timestamp_col], normalize_features(chunk[feat_cols], stats)], axis=1)
+
+        fault_mask, test_mask = get_chunk_masks(chunk.index[0], len(chunk))
+        test_chunk = processed[test_mask].copy()
+        test_chunk['label'] = fault_mask[test_mask].astype(int)
+        test_rows.append(test_chunk)
+
+        train_candidates = processed[~test_mask]
+        train_chunk = train_candidates[get_normal_mask(train_candidates[feat_cols], lower_bound, upper_bound)]
+
+        train_chunk.to_csv(train_output_path, index=False, encoding='utf-8',
+                           mode='w' if train_rows == 0 else 'a', header=train_rows == 0)
+        train_rows += len(train_chunk)
+
+    # 没有任何训练行时也写出表头
+    if train_rows == 0:
+        pd.DataFrame(columns=[timestamp_col] + feat_cols).to_csv(train_output_path, index=False, encoding='utf-8')
+    print(f"训练集（已剔除异常行）已保存到：{train_output_path}")
+
+    test_df = pd.concat(test_rows).reset_index(drop=True)
+    test_df.to_csv(test_output_path, index=False, encoding='utf-8')
+    print(f"测试集（含正常和故障样本）已保存到：{test_output_path}")
+
+    return train_rows, test_df
+
+def save_stats(stats, stats_path):
+    # numpy 数值转成 float，全为 NaN 的列保存为 NaN
+    stats = {
+        key: ({col: float(v) for col, v in value.items()} if isinstance(value, dict) else value)
+        for key, value in stats.items()
+    }
+    with open(stats_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=4)
+
+def load_stats(stats_path):
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def normalize_new_rows(
+    input_csv_path: str,
+    stats_path: str,
+    output_csv_path: str = None,
+    filter_outliers: bool = True
+):
+    """
+    用 preprocess_with_row_split 保存的冻结统计量处理新增的行：
+        1. 缺失值用训练时的列均值填充
+        2. 用训练时的最小值 / 最大值做 Min–Max 归一化（常数列为 0），新数据可能超出 [0, 1]
+        3. filter_outliers=True 时，剔除超出训练时 IQR 上下界的行（与训练集的筛选一致）
+    输出与 {output_prefix}_train.csv 相同格式（时间戳 + 归一化特征）
+    """
+    stats = load_stats(stats_path)
+    timestamp_col = stats['timestamp_col']
+    columns = stats['columns']
+
+    df = pd.read_csv(input_csv_path, encoding='utf-8')
+
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"新数据缺少特征列：{', '.join(missing)}")
+
+    # 1~2. 按冻结的统计量填充缺失值并归一化
+    norm_feats = normalize_features(df[columns], stats)
+
+    # 3. 剔除超出 IQR 上下界的行
+    if filter_outliers and stats['lower_bound']:
+        lower_bound = pd.Series(stats['lower_bound'], dtype=float)
+        upper_bound = pd.Series(stats['upper_bound'], dtype=float)
+
+        mask_normal = get_normal_mask(norm_feats, lower_bound, upper_bound)
+        df = df[mask_normal]
+        norm_feats = norm_feats[mask_normal]
+
+    processed_df = pd.concat(
+        [df[timestamp_col].reset_index(drop=True), norm_feats.reset_index(drop=True)],
+        axis=1
+    )
+
+    if output_csv_path is not None:
+        processed_df.to_csv(output_csv_path, index=False, encoding='utf-8')
+        print(f"新增数据（{len(processed_df)} 行）已保存到：{output_csv_path}")
+
+    return processed_df
+
 if __name__ == "__main__":
     # 示例用法：
     input_path    = r"/Online-Boutique/data_process/tabel1.csv"
@@ -144,3 +409,8 @@ if __name__ == "__main__":
         epsilon=1e-6,
         k=1.5
     )
+
+    # 多个故障区间：incidents.csv 每行一个区间，如
+    #   start,end
+    #   2025/6/4 21:50,2025/6/4 22:50
+    # preprocess_with_row_split(input_path, output_prefix, timestamp_col="Time", incident_path="incidents.csv")